@@ -1,9 +1,77 @@
-import re
-from flask import Flask, render_template, request, jsonify
-from search import Search
+import asyncio
+import base64
+import functools
+import inspect
+import json
+import os
+import time
+
+import click
+from flask import Flask, Response, g, make_response, redirect, render_template, request, url_for
+from opensearchpy import NotFoundError
+
+from cache import SingleFlight, normalize_query
+from facets import FACET_AGGS, FacetSnapshot, process_aggregations
+from metrics import REQUEST_SECONDS, REQUESTS, registry, stage
+from queries import autocomplete_query, extract_filters, query_bodies
+from responses import compress, etag_for, json_response, not_modified, set_cache_headers
+from retrieval import get_mode
+from search import Search, document_payload, empty_response
+from suggest import LocalSuggester, balance_suggestions, extends_prefix, filter_groups
 
 app = Flask(__name__)
-ops = Search()
+SEARCH_ASYNC = os.getenv("SEARCH_ASYNC", "0") == "1"
+if SEARCH_ASYNC:
+    from async_search import AsyncSearch
+
+    ops = AsyncSearch()
+else:
+    ops = Search()
+# optional in-process autocomplete, falls back to OpenSearch when it has no match
+AUTOCOMPLETE_SNAPSHOT = os.getenv("AUTOCOMPLETE_SNAPSHOT")
+suggester = LocalSuggester(AUTOCOMPLETE_SNAPSHOT) if AUTOCOMPLETE_SNAPSHOT else None
+autocomplete_flight = SingleFlight()
+# optional precomputed facets of the landing view and single-filter views, written by
+# `flask reindex` and `flask sync`
+FACETS_SNAPSHOT = os.getenv("FACETS_SNAPSHOT")
+facet_snapshot = FacetSnapshot(FACETS_SNAPSHOT) if FACETS_SNAPSHOT else None
+# "prefix" (match_bool_prefix) or "search_as_you_type" (needs an index created by this version)
+AUTOCOMPLETE_MODE = os.getenv("AUTOCOMPLETE_MODE", "prefix")
+# retrieval modes (see retrieval.PRESETS) of the results page and of batch search
+SEARCH_MODE = get_mode(os.getenv("SEARCH_MODE", "hybrid"))
+BATCH_SEARCH_MODE = get_mode(os.getenv("BATCH_SEARCH_MODE", os.getenv("SEARCH_MODE", "hybrid")))
+# queries one /search/batch request may send, they all go out in a single _msearch
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))
+# seconds browsers and CDNs may reuse GET /search and GET /autocomplete responses before
+# revalidating them with their ETag
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))
+HTTP_COMPRESSION = os.getenv("HTTP_COMPRESSION", "1") == "1"
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    if "request_start" in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint)
+    REQUESTS.inc(endpoint, str(response.status_code))
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    if HTTP_COMPRESSION:
+        return compress(response, request.accept_encodings)
+    return response
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.get("/")
@@ -11,219 +79,506 @@ def index():
     return render_template("index.html")
 
 
-def extract_filters(query):
-    filters = []
+# total order for search_after: the score, then the stable document ID as a tiebreaker
+BROWSE_SORT = [
+    {"_score": "desc"},
+    {"doc_id": {"order": "asc", "unmapped_type": "keyword"}},
+]
 
-    category_regex = r"category:([^\s]+)\s*"  # matches like "category:books" because of the \s* at the end which allows for optional whitespace after the category
-    matches = re.search(category_regex, query)
-    if matches:
-        filters.append({"term": {"category.keyword": {"value": matches.group(1)}}})
 
-        # remove the category filter from the query
-        query = re.sub(category_regex, "", query).strip()
+def encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
 
-    # year filter
-    year_regex = r"year:([^\s]+)\s*"
-    matches = re.search(year_regex, query)
-    if matches:
-        filters.append(
-            {
-                "range": {
-                    "updated_at": {
-                        "gte": f"{matches.group(1)}||/y",
-                        "lte": f"{matches.group(1)}||/y",
-                    }
-                },
-            }
+
+# {"pit": point in time ID or None, "after": sort values of the last hit}, None when the
+# value is missing or malformed
+def decode_cursor(value):
+    if not value:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(value.encode()))
+    except ValueError:
+        return None
+    if not isinstance(cursor, dict) or not isinstance(cursor.get("pit"), (str, type(None))):
+        return None
+    # one sort value per BROWSE_SORT entry: the score, then the document ID
+    after = cursor.get("after")
+    if (
+        not isinstance(after, list)
+        or len(after) != len(BROWSE_SORT)
+        or not isinstance(after[0], (int, float))
+        or isinstance(after[0], bool)
+        or not isinstance(after[1], str)
+    ):
+        return None
+    return cursor
+
+
+# from + size limit of the index (index.max_result_window); deeper browse pages need a cursor
+MAX_RESULT_WINDOW = 10000
+
+# the fields a results page shows; the content is only needed on the document page
+RESULT_SOURCE = {"includes": ["name", "summary", "category", "updated_at", "created_on"]}
+
+
+# await the result of a Search method whether it is synchronous or a coroutine (AsyncSearch)
+async def call(method, *args, **kwargs):
+    result = method(*args, **kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+# run a coroutine that never suspends to completion without an event loop; with the
+# synchronous Search every `call` returns at once
+def resolve(coroutine):
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("A synchronous view awaited a pending result.")
+
+
+# request handlers are written once as coroutines. With SEARCH_ASYNC=1 they are
+# registered as async views; otherwise they run on the request thread like plain views,
+# because Flask would start a new event loop and thread for every async view call
+def view(handler):
+    if SEARCH_ASYNC:
+        return handler
+
+    @functools.wraps(handler)
+    def run(*args, **kwargs):
+        return resolve(handler(*args, **kwargs))
+
+    return run
+
+
+# independent steps of a request, concurrent in the async mode and in order otherwise
+async def gather(*coroutines):
+    if SEARCH_ASYNC:
+        return await asyncio.gather(*coroutines)
+    return [await coroutine for coroutine in coroutines]
+
+
+# facets and the total only depend on the query and filters, not on the page, so they
+# are fetched once with a size 0 request and reused by every page of the same query
+async def fetch_facets(parsed_query, filters, facet_query, mode):
+    if facet_snapshot and not parsed_query.strip():
+        facets = facet_snapshot.get(filters)
+        if facets is not None:
+            return facets
+    facets_key = {
+        "query": normalize_query(parsed_query),
+        "filters": filters,
+        "subqueries": mode.subqueries,
+    }
+    facets = ops.facet_cache.get(facets_key)
+    if facets is None:
+        facet_results = await call(
+            ops.search,
+            query=facet_query,
+            aggs=FACET_AGGS,
+            size=0,
+            track_total_hits=True,
         )
-        # remove the year filter from the query
-        query = re.sub(year_regex, "", query).strip()
+        with stage("post_processing"):
+            facets = {
+                "total": facet_results["hits"]["total"]["value"],
+                "aggs": process_aggregations(facet_results["aggregations"]),
+            }
+        ops.facet_cache.set(facets_key, facets)
+    return facets
+
 
-    return {"filter": filters}, query
+# hits of one results page and the cursor of the next one (browse pages only)
+async def fetch_results(parsed_query, filters, search_query, from_, cursor, mode):
+    next_cursor = None
+    if parsed_query.strip():
+        cache_key = {
+            "query": normalize_query(parsed_query),
+            "filters": filters,
+            "from": from_,
+            "size": 5,
+            "mode": repr(mode),
+        }
+        results = ops.query_cache.get(cache_key)
+        if results is None:
+            if mode.exhausted(from_):
+                results = empty_response()
+            elif mode.local:
+                results = await call(
+                    ops.local_fusion_search,
+                    search_query["hybrid"]["queries"],
+                    size=5,
+                    from_=from_,
+                    depth=mode.depth(from_, 5),
+                    _source=RESULT_SOURCE,
+                )
+            else:
+                # page requests skip aggregations and total hit counting
+                results = await call(
+                    ops.search,
+                    search_pipeline=mode.pipeline,
+                    query=search_query,
+                    size=5,
+                    from_=from_,
+                    track_total_hits=False,
+                    _source=RESULT_SOURCE,
+                )
+            ops.query_cache.set(cache_key, results)
+    elif cursor:
+        # deeper browse pages continue after the last hit of the previous page inside a
+        # point in time, so every page costs the same however far the user has paged
+        pit_id = cursor["pit"] or await call(ops.browse_point_in_time)
+        try:
+            results = await browse_after(pit_id, cursor["after"], search_query)
+        except NotFoundError:
+            # the point in time expired or was closed, continue in a current one
+            ops.forget_point_in_time(pit_id)
+            pit_id = await call(ops.browse_point_in_time)
+            results = await browse_after(pit_id, cursor["after"], search_query)
+        next_cursor = {"pit": pit_id}
+    else:
+        # the first browse page, or a shallow one reached without a cursor
+        cache_key = {"query": "", "filters": filters, "from": from_, "size": 5}
+        results = ops.query_cache.get(cache_key)
+        if results is None:
+            if from_ + 5 > MAX_RESULT_WINDOW:
+                results = empty_response()
+            else:
+                results = await call(
+                    ops.search,
+                    query=search_query,
+                    size=5,
+                    from_=from_,
+                    sort=BROWSE_SORT,
+                    track_total_hits=False,
+                    _source=RESULT_SOURCE,
+                )
+            ops.query_cache.set(cache_key, results)
+        next_cursor = {"pit": None}
+    hits = results["hits"]["hits"]
+    ops.prefetch_documents([hit["_id"] for hit in hits])
+    if next_cursor is not None and hits:
+        next_cursor["after"] = hits[-1]["sort"]
+        return results, next_cursor
+    return results, None
+
+
+def browse_after(pit_id, after, search_query):
+    return call(
+        ops.search_after,
+        pit_id,
+        after,
+        query=search_query,
+        size=5,
+        sort=BROWSE_SORT,
+        track_total_hits=False,
+        _source=RESULT_SOURCE,
+    )
 
 
 @app.post("/")
-def handle_search():
+@view
+async def handle_search():
     query = request.form.get("query", "")
-    filters, parsed_query = extract_filters(query)
     from_ = request.form.get("from_", type=int, default=0)
-
+    return await render_search(query, from_, request.form.get("cursor"))
+
+
+# cacheable results page: /search?q=...&from=10. Other spellings of the same query are
+# redirected to one canonical URL so browsers and CDNs store each page once
+@app.get("/search")
+@view
+async def search_page():
+    query = request.args.get("q", "")
+    from_ = request.args.get("from", type=int, default=0)
+    cursor = request.args.get("cursor")
+    canonical = canonical_search_args(query, from_, cursor)
+    if request.args.to_dict() != canonical:
+        return redirect(url_for("search_page", **canonical), code=301)
+    if cursor:
+        # browse cursors point into a point in time that expires, never store them
+        response = make_response(await render_search(query, from_, cursor))
+        response.cache_control.no_store = True
+        return response
+    etag = generation_etag(
+        [
+            "search",
+            canonical,
+            repr(SEARCH_MODE),
+            facet_snapshot.version if facet_snapshot else None,
+        ]
+    )
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return not_modified(etag, HTTP_CACHE_MAX_AGE)
+    response = make_response(await render_search(query, from_, None))
+    return set_cache_headers(response, etag, HTTP_CACHE_MAX_AGE)
+
+
+# ETag of a response that changes with the index generation, None when the generation is
+# local to this process: a reindex run from the CLI would not change it, and clients
+# revalidating would be told their copy is current forever
+def generation_etag(parts):
+    if not ops.shared_generation:
+        return None
+    return etag_for(ops.query_cache.generation(), parts)
+
+
+def canonical_search_args(query, from_, cursor):
+    args = {"q": " ".join(query.split())}
+    if from_ > 0:
+        args["from"] = str(from_)
+    if cursor:
+        args["cursor"] = cursor
+    return args
+
+
+async def render_search(query, from_, cursor):
+    with stage("filter_parsing"):
+        filters, parsed_query = extract_filters(query)
+    cursor = decode_cursor(cursor)
+
+    # neural query setup with filters
+    mode = SEARCH_MODE
+    model_ids = {}
+    query_tokens = None
     if parsed_query.strip():
-        lex_query = {
-            "bool": {
-                "must": [
-                    {
-                        "multi_match": {
-                            "query": parsed_query,
-                            "fields": ["name", "summary", "content"],
-                        }
-                    }
-                ],
-                **filters,
-            }
-        }
-        # neural query setup with filters
-        model_id = ops.get_model_id(
-            "amazon/neural-sparse/opensearch-neural-sparse-encoding-v2-distill"
-        )
-
-        neural_query = {
-            "bool": {
-                "must": [
-                    {
-                        "neural_sparse": {
-                            "summary_sparse_embedding": {
-                                "query_text": parsed_query,
-                                "model_id": model_id,
-                            }
-                        }
-                    }
-                ],
-                **filters,
-            }
-        }
-        # combine the lexical and neural queries in a hybrid query
-        search_query = {
-            "hybrid": {
-                "queries": [
-                    lex_query,
-                    neural_query,
-                ],
-                "pagination_depth": 50,  #It specifies the maximum number of search results to retrieve from each shard for every subquery.
-            }
-        }
-    else:
-        search_query = {"bool": {"must": [{"match_all": {}}], **filters}}
+        with stage("model_id"):
+            model_ids = ops.mode_model_ids(mode)
+        if "sparse" in mode.subqueries:
+            with stage("query_tokens"):
+                query_tokens = await call(ops.query_tokens, parsed_query, model_ids["sparse"])
+    search_query, facet_query = query_bodies(
+        query,
+        model_ids,
+        depth=mode.depth(from_, 5),
+        query_tokens=query_tokens,
+        subqueries=mode.subqueries,
+    )
 
-    results = ops.search(
-        query=search_query,
-        aggs={
-            "category-agg": {
-                "terms": {
-                    "field": "category.keyword",
-                }
-            },
-            "year-agg": {
-                "date_histogram": {
-                    "field": "updated_at",
-                    "calendar_interval": "year",
-                    "format": "yyyy",
-                },
-            },
-        },
-        size=5,
-        from_=from_,
+    # the facet and page requests are independent, run them concurrently
+    facets, (results, next_cursor) = await gather(
+        fetch_facets(parsed_query, filters, facet_query, mode),
+        fetch_results(parsed_query, filters, search_query, from_, cursor, mode),
     )
 
-    # Process aggregations
-    aggs = {
-        "Category": {
-            bucket["key"]: bucket["doc_count"]
-            for bucket in results["aggregations"]["category-agg"]["buckets"]
-        },
-        "Year": {
-            bucket["key_as_string"]: bucket["doc_count"]
-            for bucket in results["aggregations"]["year-agg"]["buckets"]
-            if bucket["doc_count"] > 0
-        },
-    }
+    # text queries are not retrieved past the maximum depth of the mode, so there is no
+    # next page beyond it even though the facet total counts every match
+    last = min(facets["total"], mode.max_depth) if parsed_query.strip() else facets["total"]
+    with stage("render"):
+        return render_template(
+            "index.html",
+            results=results["hits"]["hits"],
+            query=query,
+            from_=from_,
+            total=facets["total"],
+            last=last,
+            aggs=facets["aggs"],
+            cursor=encode_cursor(next_cursor) if next_cursor else None,
+            searched=True,
+        )
 
-    return render_template(
-        "index.html",
-        results=results["hits"]["hits"],
-        query=query,
+
+# JSON batch search for services and offline evaluation:
+# {"queries": [...], "size": 5, "from": 0, "mode": "hybrid"}
+@app.post("/search/batch")
+def batch_search():
+    payload = request.get_json(force=True, silent=True)
+    if not isinstance(payload, dict):
+        return json_response({"error": "The body must be a JSON object."}, status=400)
+    queries = payload.get("queries", [])
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return json_response({"error": "'queries' must be a list of strings."}, status=400)
+    if len(queries) > BATCH_MAX_QUERIES:
+        return json_response(
+            {"error": f"At most {BATCH_MAX_QUERIES} queries are allowed per batch."}, status=400
+        )
+    size = payload.get("size", 5)
+    from_ = payload.get("from", 0)
+    for name, value in (("size", size), ("from", from_)):
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            return json_response({"error": f"'{name}' must be a non-negative integer."}, status=400)
+    if from_ + size > MAX_RESULT_WINDOW:
+        return json_response(
+            {"error": f"'from' + 'size' must not exceed {MAX_RESULT_WINDOW}."}, status=400
+        )
+    mode = payload.get("mode")
+    if mode is not None and not isinstance(mode, str):
+        return json_response({"error": "'mode' must be a string."}, status=400)
+    try:
+        mode = get_mode(mode) if mode else BATCH_SEARCH_MODE
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, status=400)
+    responses = ops.multi_search(
+        queries,
+        size=size,
         from_=from_,
-        total=results["hits"]["total"]["value"],
-        aggs=aggs,
+        mode=mode,
+        track_total_hits=True,
     )
+    results = []
+    for query, response in zip(queries, responses):
+        if "error" in response:
+            results.append({"query": query, "error": response["error"]})
+            continue
+        results.append(
+            {
+                "query": query,
+                "total": response["hits"]["total"]["value"],
+                "hits": [
+                    {"id": hit["_id"], "score": hit["_score"], "source": hit["_source"]}
+                    for hit in response["hits"]["hits"]
+                ],
+            }
+        )
+    return json_response({"results": results})
 
 
 # route for autocomplete suggestions
 @app.route("/autocomplete", methods=["POST"])
-def autocomplete():
-    search_term = request.form.get("query", "")
+@view
+async def autocomplete():
+    return json_response(await suggest(request.form.get("query", "")))
+
+
+# cacheable autocomplete: /autocomplete?q=wor
+@app.get("/autocomplete")
+@view
+async def autocomplete_get():
+    search_term = normalize_query(request.args.get("q", ""))
+    etag = generation_etag(
+        [
+            "autocomplete",
+            search_term,
+            AUTOCOMPLETE_MODE,
+            suggester.version if suggester else None,
+        ]
+    )
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return not_modified(etag, HTTP_CACHE_MAX_AGE)
+    response = json_response(await suggest(search_term))
+    return set_cache_headers(response, etag, HTTP_CACHE_MAX_AGE)
+
+
+async def suggest(search_term):
     size = 10
     collapse_size = 5
-    query_args = {
-        "from": 0,
-        "size": size,
-        "query": {
-            "dis_max": {
-                "queries": [
-                    {"match_bool_prefix": {"name": {"query": search_term, "boost": 1.2}}},
-                    {"match_bool_prefix": {"category": {"query": search_term}}},
-                    {"match_bool_prefix": {"summary": {"query": search_term}}},
-                    {"match_bool_prefix": {"content": {"query": search_term, "boost": 0.5}}},
-                ],
-                "tie_breaker": 0.7,
-            }
-        },
-        "fields": ["name", "category", "summary", "content"],
-        "_source": False,
-        "collapse": {
-            "field": "category.keyword",
-            "inner_hits": {
-                "name": "category_hits",
-                "size": collapse_size,
-                "fields": ["name"],
-                "_source": False,
-            },
-        },
-    }
+    if suggester:
+        with stage("local_suggest"):
+            groups = suggester.search(search_term, size=size, collapse_size=collapse_size)
+        if groups:
+            with stage("post_processing"):
+                return balance_suggestions(groups, size)
+    search_term = normalize_query(search_term)
+    suggestions = ops.autocomplete_cache.get(search_term)
+    if suggestions is None and AUTOCOMPLETE_MODE == "search_as_you_type":
+        # the prefix mode also matches content, which the cached groups cannot be checked
+        # against, so only search_as_you_type results are narrowed down locally
+        with stage("post_processing"):
+            suggestions = cached_shorter_prefix(search_term)
+    if suggestions is None:
+        # concurrent requests for the same prefix share one OpenSearch query
+        if SEARCH_ASYNC:
+            suggestions = await autocomplete_flight.run(
+                search_term, lambda: fetch_suggestions(search_term, size, collapse_size)
+            )
+        else:
+            suggestions = autocomplete_flight.call(
+                search_term, lambda: resolve(fetch_suggestions(search_term, size, collapse_size))
+            )
+    # Post-process results to ensure diverse categories
+    with stage("post_processing"):
+        return balance_suggestions(suggestions["groups"], size)
 
-    results =ops.search(**query_args)
 
-    # Post-process results to ensure diverse categories
-    total_hits = results["hits"]["total"]["value"]
-    cats_with_hits = len(results["hits"]["hits"])
-    avg_hits_cat = int(size / cats_with_hits) if cats_with_hits > 0 else 0
-    hits_for_cats = []
-    accum_hits = 0
-    cats_with_more = 0
-
-    for item in results["hits"]["hits"]:
-        cat_hits = item["inner_hits"]["category_hits"]["hits"]["total"]["value"]
-        if cat_hits > avg_hits_cat:
-            cats_with_more += 1
-        hits_this_cat = min(cat_hits, avg_hits_cat)
-        hits_for_cats.append([cat_hits, hits_this_cat])
-    
-    if accum_hits < size and cats_with_more:
-        more_each = int((size - accum_hits) / cats_with_more)
-        for counts in hits_for_cats:
-            more_this_cat = min(more_each, counts[0] - counts[1])
-            accum_hits += more_this_cat
-            counts[1] += more_this_cat
-
-    found_items = []
-
-    for idx, item in enumerate(results["hits"]["hits"]):
-        cat_hits = item["inner_hits"]["category_hits"]["hits"]["hits"]
-
-        if accum_hits < size and hits_for_cats[idx][1] < hits_for_cats[idx][0]:
-            to_add = min(size - accum_hits, hits_for_cats[idx][0] - hits_for_cats[idx][1])
-            hits_for_cats[idx][1] += to_add
-            accum_hits += to_add
-
-        added = 0
-        for hit in cat_hits:
-            found_items.append({
-                'itemId': hit['_id'],
-                'name': hit['fields'].get('name', [None])[0],
-                'category': item['fields'].get('category', [None])[0],
-            })
-            added += 1
-            if added == hits_for_cats[idx][1]:
-                break
-    return jsonify(found_items)
+async def fetch_suggestions(search_term, size, collapse_size):
+    results = await call(
+        ops.search, **autocomplete_query(search_term, size, collapse_size, AUTOCOMPLETE_MODE)
+    )
+
+    with stage("post_processing"):
+        groups = group_suggestions(results)
+    suggestions = {
+        "groups": groups,
+        # every matching document is in the groups, so longer prefixes can be served by
+        # filtering them instead of querying again
+        "complete": results["hits"]["total"]["value"]
+        == sum(len(group["hits"]) for group in groups),
+    }
+    ops.autocomplete_cache.set(search_term, suggestions)
+    return suggestions
+
+
+# category groups of a collapsed autocomplete response
+def group_suggestions(results):
+    return [
+        {
+            "category": item["fields"].get("category", [None])[0],
+            "total": item["inner_hits"]["category_hits"]["hits"]["total"]["value"],
+            "hits": [
+                {
+                    "itemId": hit["_id"],
+                    "name": hit["fields"].get("name", [None])[0],
+                    "summary": hit["fields"].get("summary", [None])[0],
+                }
+                for hit in item["inner_hits"]["category_hits"]["hits"]["hits"]
+            ],
+        }
+        for item in results["hits"]["hits"]
+    ]
+
+
+# serve a prefix from a cached complete result for one of its shorter prefixes
+def cached_shorter_prefix(search_term):
+    for end in range(len(search_term) - 1, 1, -1):
+        shorter = search_term[:end]
+        if not extends_prefix(shorter, search_term):
+            continue
+        suggestions = ops.autocomplete_cache.get(shorter)
+        if suggestions is not None:
+            if not suggestions["complete"]:
+                return None
+            return {"groups": filter_groups(suggestions["groups"], search_term), "complete": True}
+    return None
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return json_response(
+        {
+            "query_cache": ops.query_cache.stats(),
+            "facet_cache": ops.facet_cache.stats(),
+            "query_tokens_cache": ops.query_tokens_cache.stats(),
+            "document_cache": ops.document_cache.stats(),
+            "facets_snapshot": {"hits": facet_snapshot.hits if facet_snapshot else 0},
+            "autocomplete_cache": dict(
+                ops.autocomplete_cache.stats(), merged=autocomplete_flight.merged
+            ),
+        }
+    )
 
 
 @app.get("/document/<id>")
-def get_document(id):
-    document = ops.retrieve_document(id)
-    title = document["_source"]["name"]
-    paragraphs = document["_source"]["content"].split("\n")
-    return render_template("document.html", title=title, paragraphs=paragraphs)
+@view
+async def get_document(id):
+    payload = ops.document_cache.get(id)
+    if payload is None:
+        document = await call(ops.retrieve_document, id)
+        payload = document_payload(document["_source"])
+        ops.document_cache.set(id, payload)
+    with stage("render"):
+        return render_template("document.html", **payload)
+
+
+@app.cli.command()
+def health_check():
+    """Check the connection to the Opensearch cluster"""
+    try:
+        ops.health_check()
+    except Exception as exc:
+        print(f"Error connecting to Opensearch: {exc}")
 
 
 @app.cli.command()
@@ -236,10 +591,13 @@ def update_cluster_settings():
 
 
 @app.cli.command()
-def deploy_models():
+@click.option("--timeout", default=1800, help="Seconds to wait for all models to be deployed.")
+def deploy_models(timeout):
     """Deploy models to the Opensearch cluster"""
     try:
-        ops.deploy_models()
+        model_ids = ops.deploy_models(timeout=timeout)
+        for model_name, model_id in model_ids.items():
+            print(f"Model '{model_name}' is deployed with ID: {model_id}")
     except Exception as exc:
         print(f"Error deploying models: {exc}")
 
@@ -253,10 +611,84 @@ def create_pipelines():
         print(f"Error creating pipelines: {exc}")
 
 @app.cli.command()
-def reindex():
+@click.option("--file", "path", default="data.json", help="JSON array or JSON Lines file to ingest.")
+@click.option("--batch-size", default=500, help="Maximum documents per bulk request.")
+@click.option("--max-bytes", default=5 * 1024 * 1024, help="Maximum payload size per bulk request.")
+@click.option("--workers", default=4, help="Number of concurrent bulk requests.")
+@click.option(
+    "--zero-downtime",
+    is_flag=True,
+    help="Build a new versioned index and swap the alias onto it when it is ready.",
+)
+@click.option("--keep", default=2, help="Previous indices to keep for rollback (with --zero-downtime).")
+def reindex(path, batch_size, max_bytes, workers, zero_downtime, keep):
     """Regenerate the Opensearch index"""
-    response = ops.reindex()
+    stats = ops.reindex(
+        path,
+        batch_size=batch_size,
+        max_bytes=max_bytes,
+        workers=workers,
+        zero_downtime=zero_downtime,
+        keep=keep,
+        snapshot=AUTOCOMPLETE_SNAPSHOT,
+        facets_snapshot=FACETS_SNAPSHOT,
+    )
+    print(
+        f"Index with {stats['documents']} documents created "
+        f"in {stats['took']} milliseconds "
+        f"({stats['batches']} batches, {stats['docs_per_second']:.1f} docs/s, "
+        f"{stats['errors']} errors, {stats['duplicates']} duplicates skipped)"
+    )
+
+
+@app.cli.command()
+@click.option("--file", "path", default="data.json", help="JSON array or JSON Lines file to sync.")
+@click.option(
+    "--manifest",
+    default=None,
+    help="Local {id: hash} manifest to compare against instead of scrolling the index.",
+)
+@click.option("--batch-size", default=500, help="Maximum operations per bulk request.")
+@click.option("--max-bytes", default=5 * 1024 * 1024, help="Maximum payload size per bulk request.")
+@click.option("--workers", default=4, help="Number of concurrent bulk requests.")
+def sync(path, manifest, batch_size, max_bytes, workers):
+    """Index new and changed documents and delete removed ones"""
+    stats = ops.sync(
+        path,
+        manifest=manifest,
+        batch_size=batch_size,
+        max_bytes=max_bytes,
+        workers=workers,
+        snapshot=AUTOCOMPLETE_SNAPSHOT,
+        facets_snapshot=FACETS_SNAPSHOT,
+    )
     print(
-        f"Index with {len(response['items'])} documents created "
-        f"in {response['took']} milliseconds"
-    )
\ No newline at end of file
+        f"Synced {stats['new']} new, {stats['changed']} changed and "
+        f"{stats['deleted']} deleted documents ({stats['unchanged']} unchanged) "
+        f"in {stats['took']} milliseconds with {stats['errors']} errors "
+        f"({stats['duplicates']} duplicates skipped)"
+    )
+
+
+@app.cli.command()
+@click.argument("query_log", type=click.File("rt"))
+@click.option(
+    "--output",
+    default=lambda: os.getenv("QUERY_TOKENS_SNAPSHOT", "query_tokens.json"),
+    help="Snapshot file the app loads through QUERY_TOKENS_SNAPSHOT.",
+)
+def warm_query_tokens(query_log, output):
+    """Precompute sparse query embeddings for the queries in a log"""
+    queries = (line.strip() for line in query_log if line.strip())
+    count = ops.warm_query_tokens(queries, output)
+    print(f"{count} query embeddings written to {output}")
+
+
+@app.cli.command()
+def rollback_index():
+    """Point the index alias back to the previous index"""
+    try:
+        index = ops.rollback_index()
+        print(f"Rolled back to index '{index}'.")
+    except Exception as exc:
+        print(f"Error rolling back index: {exc}")
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+from opensearchpy import AsyncOpenSearch, TransportError
+
+from cache import normalize_query
+from metrics import record_query
+from queries import pagination_depth
+from search import (
+    DOCUMENT_FIELDS,
+    EMBEDDING_FIELDS,
+    INDEX_NAME,
+    Search,
+    client_options,
+    is_model_not_found,
+    sparse_tokens,
+)
+
+
+class AsyncSearch(Search):
+    """Search whose request-path methods are coroutines backed by AsyncOpenSearch.
+
+    The async client and its connection pool live on one background event loop, so
+    requests handled on other loops share pooled connections. Admin and CLI methods are
+    inherited unchanged and keep using the synchronous client.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        # AsyncOpenSearch only connects on the first request
+        self.async_ops = AsyncOpenSearch(**client_options(async_client=True))
+
+    # await a client coroutine on the background loop from the caller's loop
+    async def run(self, coro):
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def search(self, search_pipeline="rrf-pipeline", **query_args):
+        if "from_" in query_args:
+            query_args["from"] = query_args["from_"]
+            del query_args["from_"]
+        query_args.setdefault("_source", {"excludes": EMBEDDING_FIELDS})
+        start = time.perf_counter()
+        try:
+            response = await self.run(
+                self.async_ops.search(
+                    index=INDEX_NAME,
+                    body=query_args,
+                    params={"search_pipeline": search_pipeline} if search_pipeline else {},
+                )
+            )
+        except Exception as exc:
+            if is_model_not_found(exc):
+                self.model_ids.refresh_in_background()
+            raise
+        record_query("search", query_args, time.perf_counter() - start, response)
+        return response
+
+    async def local_fusion_search(self, subqueries, size=5, from_=0, depth=None, **query_args):
+        depth = depth or pagination_depth(from_, size)
+        query_args.setdefault("_source", {"excludes": EMBEDDING_FIELDS})
+        parts, rankings, body = self._cached_rankings(subqueries, depth, query_args)
+        fetched = []
+        if body:
+            start = time.perf_counter()
+            response = await self.run(self.async_ops.msearch(body=body))
+            record_query("msearch", body, time.perf_counter() - start, response)
+            fetched = response["responses"]
+        result = self._fuse(parts, rankings, fetched, size, from_)
+        if "error" in result:
+            raise TransportError(500, "subquery_failed", result["error"])
+        return result
+
+    async def query_tokens(self, parsed_query, model_id):
+        tokens = self.cached_query_tokens(parsed_query, model_id)
+        if tokens is None:
+            text = normalize_query(parsed_query)
+            tokens = await self._token_flight.run(
+                (model_id, text), lambda: self._fill_query_tokens_async(model_id, text)
+            )
+        return tokens
+
+    async def _fill_query_tokens_async(self, model_id, text):
+        try:
+            response = await self.run(
+                self.async_ops.transport.perform_request(
+                    "POST",
+                    f"/_plugins/_ml/_predict/sparse_encoding/{model_id}",
+                    body={"text_docs": [text]},
+                )
+            )
+        except Exception as exc:
+            print(f"Could not encode query '{text}': {exc}")
+            return None
+        tokens = sparse_tokens(response)
+        self.query_tokens_cache.set(model_id, text, tokens)
+        return tokens
+
+    async def open_point_in_time(self, keep_alive="5m"):
+        response = await self.run(
+            self.async_ops.create_point_in_time(index=INDEX_NAME, keep_alive=keep_alive)
+        )
+        return response["pit_id"]
+
+    async def browse_point_in_time(self):
+        pit_id = self._shared_pit()
+        if pit_id is None:
+            pit_id = self._share_pit(await self.open_point_in_time())
+        return pit_id
+
+    async def search_after(self, pit_id, after, keep_alive="5m", **query_args):
+        query_args["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+        query_args["search_after"] = after
+        query_args.setdefault("_source", {"excludes": EMBEDDING_FIELDS})
+        start = time.perf_counter()
+        response = await self.run(self.async_ops.search(body=query_args))
+        record_query("search_after", query_args, time.perf_counter() - start, response)
+        return response
+
+    async def retrieve_document(self, id):
+        return await self.run(
+            self.async_ops.get(index=INDEX_NAME, id=id, _source_includes=DOCUMENT_FIELDS)
+        )
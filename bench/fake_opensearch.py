@@ -0,0 +1,268 @@
+"""Local OpenSearch stand-in for benchmarks.
+
+Serves the endpoints the app uses with payloads shaped like a real cluster's (hybrid hits,
+collapsed autocomplete hits, facet aggregations, _msearch, point in time, documents),
+built from data.json, after a configurable latency. Run it on its own with
+
+    python -m bench.fake_opensearch --port 19200 --latency 5
+
+and point the app at it with OPENSEARCH_HOSTS=localhost:19200 OPENSEARCH_USE_SSL=0.
+"""
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from ingest import content_hash, document_id, iter_documents
+
+
+class FakeCluster:
+    def __init__(self, path="data.json", latency_ms=5.0, jitter_ms=2.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.documents = []
+        for document in iter_documents(path):
+            id = document_id(document)
+            self.documents.append(
+                (id, dict(document, doc_id=id, content_hash=content_hash(document)))
+            )
+        self.by_id = dict(self.documents)
+
+    def delay(self):
+        time.sleep(max(self.latency_ms + random.uniform(-1, 1) * self.jitter_ms, 0) / 1000)
+
+    def source(self, document, body, params=None):
+        source_filter = body.get("_source", True)
+        if params and ("_source_includes" in params or "_source_excludes" in params):
+            includes = params.get("_source_includes")
+            source_filter = {
+                "includes": includes.split(",") if includes else None,
+                "excludes": params.get("_source_excludes", "").split(","),
+            }
+        if source_filter is False:
+            return None
+        if isinstance(source_filter, dict):
+            excludes = source_filter.get("excludes", [])
+            includes = source_filter.get("includes")
+            document = {
+                key: value
+                for key, value in document.items()
+                if key not in excludes and (not includes or key in includes)
+            }
+        return document
+
+    def search(self, body):
+        size = body.get("size", 10)
+        start = body.get("from", 0)
+        hits_total = len(self.documents)
+        took = random.randint(2, 20)
+        if "collapse" in body:
+            return {"took": took, "hits": self.collapsed(size, body)}
+        response = {
+            "took": took,
+            "timed_out": False,
+            "hits": {
+                "total": {"value": hits_total, "relation": "eq"},
+                "max_score": 1.0,
+                "hits": [
+                    {
+                        "_index": "my_documents",
+                        "_id": id,
+                        "_score": 1.0 / (start + rank + 1),
+                        "_source": self.source(document, body),
+                        "sort": [1.0, id],
+                    }
+                    for rank, (id, document) in enumerate(self.documents[start:start + size])
+                ],
+            },
+        }
+        if "aggs" in body:
+            response["aggregations"] = self.aggregations(body["aggs"])
+        return response
+
+    def collapsed(self, size, body):
+        inner_size = body["collapse"]["inner_hits"]["size"]
+        by_category = {}
+        for id, document in self.documents:
+            by_category.setdefault(document["category"], []).append((id, document))
+        return {
+            "total": {"value": len(self.documents), "relation": "eq"},
+            "hits": [
+                {
+                    "_id": documents[0][0],
+                    "fields": {"category": [category]},
+                    "inner_hits": {
+                        "category_hits": {
+                            "hits": {
+                                "total": {"value": len(documents), "relation": "eq"},
+                                "hits": [
+                                    {
+                                        "_id": id,
+                                        "fields": {
+                                            "name": [document["name"]],
+                                            "summary": [document["summary"]],
+                                        },
+                                    }
+                                    for id, document in documents[:inner_size]
+                                ],
+                            }
+                        }
+                    },
+                }
+                for category, documents in list(by_category.items())[:size]
+            ],
+        }
+
+    @staticmethod
+    def year(document):
+        return (document.get("updated_at") or document.get("created_on") or "")[:4]
+
+    @staticmethod
+    def facet_buckets(documents):
+        categories = {}
+        years = {}
+        for document in documents:
+            categories[document["category"]] = categories.get(document["category"], 0) + 1
+            year = FakeCluster.year(document)
+            if year:
+                years[year] = years.get(year, 0) + 1
+        by_count = sorted(categories.items(), key=lambda item: (-item[1], item[0]))
+        return (
+            [{"key": key, "doc_count": count} for key, count in by_count],
+            [
+                {"key_as_string": key, "key": 0, "doc_count": count}
+                for key, count in sorted(years.items())
+            ],
+        )
+
+    # the facet aggregations, plus the per-category and per-year breakdowns of the
+    # facets snapshot when they are requested
+    def aggregations(self, requested=()):
+        documents = [document for _, document in self.documents]
+        categories, years = self.facet_buckets(documents)
+        aggregations = {
+            "category-agg": {"buckets": categories[:10]},
+            "year-agg": {"buckets": years},
+        }
+        if "by-category" in requested:
+            aggregations["by-category"] = {"buckets": []}
+            for bucket in categories:
+                matching = [d for d in documents if d["category"] == bucket["key"]]
+                aggregations["by-category"]["buckets"].append(
+                    dict(bucket, **{"year-agg": {"buckets": self.facet_buckets(matching)[1]}})
+                )
+        if "by-year" in requested:
+            aggregations["by-year"] = {"buckets": []}
+            for bucket in years:
+                matching = [d for d in documents if self.year(d) == bucket["key_as_string"]]
+                aggregations["by-year"]["buckets"].append(
+                    dict(bucket, **{"category-agg": {"buckets": self.facet_buckets(matching)[0][:10]}})
+                )
+        return aggregations
+
+    def handle(self, method, path, body):
+        path, _, query_string = path.partition("?")
+        params = dict(parse_qsl(query_string))
+        if path == "/":
+            return 200, {"name": "fake", "cluster_name": "fake", "version": {"number": "2.19.0"}}
+        if path.startswith("/_cluster/health"):
+            return 200, {"cluster_name": "fake", "status": "green", "number_of_nodes": 1}
+        if path == "/_plugins/_ml/models/_search":
+            return 200, {"hits": {"hits": [{"_id": "fake-model", "_source": {"model_id": "fake-model"}}]}}
+        if path.startswith("/_plugins/_ml/_predict/sparse_encoding/"):
+            tokens = {token: 1.0 for token in re.findall(r"\w+", body["text_docs"][0].lower())}
+            return 200, {"inference_results": [{"output": [{"dataAsMap": {"response": [tokens]}}]}]}
+        if path.endswith("/_refresh"):
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if path.endswith("/_search/point_in_time"):
+            return 200, {"pit_id": "fake-pit"}
+        if path.endswith("/_msearch"):
+            bodies = body[1::2]
+            return 200, {"took": 5, "responses": [self.search(item) for item in bodies]}
+        if path.endswith("/_mget"):
+            return 200, {
+                "docs": [
+                    {
+                        "_id": id,
+                        "found": id in self.by_id,
+                        "_source": self.source(self.by_id.get(id, {}), body, params),
+                    }
+                    for id in body.get("ids", [])
+                ]
+            }
+        if path.endswith("/_search"):
+            return 200, self.search(body or {})
+        match = re.match(r"/[^/]+/_doc/([^/]+)$", path)
+        if match and method == "GET":
+            id = match.group(1)
+            if id not in self.by_id:
+                return 404, {"_id": id, "found": False}
+            source = self.source(self.by_id[id], {}, params)
+            return 200, {"_id": id, "found": True, "_source": source}
+        return 404, {"error": f"no handler for {method} {path}"}
+
+
+def make_handler(cluster):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            if self.headers.get("Content-Encoding") == "gzip":
+                raw = gzip.decompress(raw)
+            if not raw:
+                return None
+            text = raw.decode()
+            if self.path.split("?", 1)[0].endswith("/_msearch"):
+                return [json.loads(line) for line in text.splitlines() if line.strip()]
+            return json.loads(text)
+
+        def respond(self):
+            body = self.read_body()
+            cluster.delay()
+            status, payload = cluster.handle(self.command, self.path, body)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = respond
+
+    return Handler
+
+
+# start a fake cluster on a background thread and return the server (port 0 picks a free port)
+def serve(port=0, path="data.json", latency_ms=5.0, jitter_ms=2.0):
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", port), make_handler(FakeCluster(path, latency_ms, jitter_ms))
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=19200)
+    parser.add_argument("--data", default="data.json")
+    parser.add_argument("--latency", type=float, default=5.0, help="mean latency in ms")
+    parser.add_argument("--jitter", type=float, default=2.0, help="latency jitter in ms")
+    args = parser.parse_args()
+    server = serve(args.port, args.data, args.latency, args.jitter)
+    print(f"Fake OpenSearch listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
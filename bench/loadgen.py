@@ -0,0 +1,149 @@
+"""Replay a query log against the Flask app at a target rate and report latency percentiles.
+
+    python -m bench.loadgen bench/queries.jsonl --qps 200 --duration 30
+
+By default the app and a fake OpenSearch cluster (bench.fake_opensearch) run in this
+process, so it works offline; pass --url to load an app that is already running instead.
+The log has one JSON object per line:
+
+    {"endpoint": "/", "form": {"query": "category:sharepoint vacation"}}
+    {"endpoint": "/autocomplete", "form": {"query": "wor"}}
+    {"endpoint": "/search/batch", "json": {"queries": ["vacation", "benefits"]}}
+    {"method": "GET", "endpoint": "/search", "params": {"q": "vacation"}}
+
+Requests are POSTed unless the line has a "method". A line with only a "query" key is
+replayed as a search.
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def load_log(path):
+    entries = []
+    with open(path, "rt") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "endpoint" not in entry:
+                entry = {"endpoint": "/", "form": {"query": entry["query"]}}
+            entries.append(entry)
+    return entries
+
+
+# start the fake cluster and the app on background threads, return the app's base URL
+def start_local_app(latency_ms, jitter_ms):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from bench.fake_opensearch import serve
+
+    cluster = serve(latency_ms=latency_ms, jitter_ms=jitter_ms)
+    os.environ["OPENSEARCH_HOSTS"] = f"127.0.0.1:{cluster.server_address[1]}"
+    os.environ["OPENSEARCH_USE_SSL"] = "0"
+    os.environ.setdefault("OPENSEARCH_ADMIN_USER", "admin")
+    os.environ.setdefault("OPENSEARCH_INITIAL_ADMIN_PASSWORD", "admin")
+    from app import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class LoadGenerator:
+    def __init__(self, base_url, entries, concurrency=32):
+        self.base_url = base_url
+        self.entries = entries
+        self.concurrency = concurrency
+        self.latencies = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    # latency is measured from when the request was due, not from when a worker picked it
+    # up, so time spent queued behind busy workers counts against the server
+    def send(self, entry, due):
+        method = entry.get("method", "POST")
+        try:
+            response = self.session().request(
+                method,
+                self.base_url + entry["endpoint"],
+                params=entry.get("params"),
+                data=entry.get("form"),
+                json=entry.get("json"),
+                timeout=30,
+            )
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - due
+        with self._lock:
+            self.latencies.setdefault(f"{method} {entry['endpoint']}", []).append(elapsed)
+            if not ok:
+                self.errors += 1
+
+    # open loop: requests are scheduled at the target rate whether or not earlier ones
+    # have finished, so a slow server shows up as latency rather than as a lower rate
+    def run(self, qps, duration):
+        interval = 1.0 / qps
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for sent, entry in enumerate(itertools.cycle(self.entries)):
+                due = start + sent * interval
+                if due - start >= duration:
+                    break
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, entry, due)
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        print(f"{'endpoint':<24}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        total = 0
+        for endpoint, latencies in sorted(self.latencies.items()):
+            total += len(latencies)
+            print(
+                f"{endpoint:<24}{len(latencies):>10}"
+                f"{percentile(latencies, 0.50) * 1000:>10.1f}"
+                f"{percentile(latencies, 0.95) * 1000:>10.1f}"
+                f"{percentile(latencies, 0.99) * 1000:>10.1f}"
+            )
+        print(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s), {self.errors} errors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="JSON Lines query log")
+    parser.add_argument("--qps", type=float, default=50.0)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--url", help="base URL of a running app instead of the local one")
+    parser.add_argument("--latency", type=float, default=5.0, help="fake cluster latency in ms")
+    parser.add_argument("--jitter", type=float, default=2.0, help="fake cluster jitter in ms")
+    args = parser.parse_args()
+    base_url = args.url or start_local_app(args.latency, args.jitter)
+    generator = LoadGenerator(base_url, load_log(args.log), args.concurrency)
+    generator.report(generator.run(args.qps, args.duration))
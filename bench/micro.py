@@ -0,0 +1,70 @@
+"""Micro-benchmarks for the Python post-processing paths.
+
+    python -m bench.micro [--number 10000]
+
+Each case prints the mean time per call; no cluster or network is needed.
+"""
+import argparse
+import os
+import timeit
+
+os.environ.setdefault("OPENSEARCH_ADMIN_USER", "admin")
+os.environ.setdefault("OPENSEARCH_INITIAL_ADMIN_PASSWORD", "admin")
+
+from bench.fake_opensearch import FakeCluster  # noqa: E402
+from facets import process_aggregations  # noqa: E402
+from ingest import batch_documents  # noqa: E402
+from queries import (  # noqa: E402
+    build_facet_query,
+    build_search_query,
+    extract_filters,
+    query_bodies,
+)
+from suggest import PrefixIndex, balance_suggestions, filter_groups  # noqa: E402
+
+
+def cases(cluster):
+    documents = [document for _, document in cluster.documents]
+    aggregations = cluster.aggregations()
+    collapsed = cluster.collapsed(10, {"collapse": {"inner_hits": {"size": 5}}})
+    groups = [
+        {
+            "category": item["fields"]["category"][0],
+            "total": item["inner_hits"]["category_hits"]["hits"]["total"]["value"],
+            "hits": [
+                {
+                    "itemId": hit["_id"],
+                    "name": hit["fields"]["name"][0],
+                    "summary": hit["fields"]["summary"][0],
+                }
+                for hit in item["inner_hits"]["category_hits"]["hits"]["hits"]
+            ],
+        }
+        for item in collapsed["hits"]
+    ]
+    prefix_index = PrefixIndex([[id, d["name"], d["category"]] for id, d in cluster.documents])
+    query = 'category:sharepoint,teams -year:2019..2020 "work from home" policy'
+    filters, parsed_query = extract_filters(query)
+    return {
+        # the parser without its memoization, then the memoized parse and query bodies
+        "extract_filters": lambda: extract_filters.__wrapped__(query),
+        "extract_filters (cached)": lambda: extract_filters(query),
+        "query_bodies (cached)": lambda: query_bodies(query, "model"),
+        "build_search_query": lambda: build_search_query(parsed_query, filters, "model"),
+        "build_facet_query": lambda: build_facet_query(parsed_query, filters, "model"),
+        "process_aggregations": lambda: process_aggregations(aggregations),
+        "balance_suggestions": lambda: balance_suggestions(groups, 10),
+        "filter_groups": lambda: filter_groups(groups, "work fr"),
+        "PrefixIndex.search": lambda: prefix_index.search("work fr"),
+        "batch_documents": lambda: list(batch_documents(documents, "my_documents")),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=10000)
+    parser.add_argument("--data", default="data.json")
+    args = parser.parse_args()
+    for name, case in cases(FakeCluster(args.data)).items():
+        seconds = min(timeit.repeat(case, number=args.number, repeat=3)) / args.number
+        print(f"{name:<24}{seconds * 1e6:>10.2f} us/call")
@@ -0,0 +1,339 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class CacheBackend:
+    """Store behind the query caches; implement this to share caches between workers."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    # counters are never evicted, they carry the index generation
+    def get_counter(self, name):
+        raise NotImplementedError
+
+    def incr_counter(self, name):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Bounded LRU with per-entry expiry, local to the process."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_counter(self, name):
+        return self._counters.get(name, 0)
+
+    def incr_counter(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+
+class RedisBackend(CacheBackend):
+    """Shared store for several app workers; requires the `redis` package."""
+
+    def __init__(self, url, prefix="search-cache:"):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("The redis cache backend requires `pip install redis`.") from exc
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+    def get_counter(self, name):
+        return int(self.client.get(f"{self.prefix}counter:{name}") or 0)
+
+    def incr_counter(self, name):
+        return self.client.incr(f"{self.prefix}counter:{name}")
+
+
+class PolledFile:
+    """A file loaded with `load(path)` and loaded again whenever it is rewritten.
+
+    The mtime is checked at most every `check_interval` seconds, so readers on the request
+    path pay for a stat call only now and then. `value` is None while the file is missing.
+    """
+
+    def __init__(self, path, load, check_interval=5.0):
+        self.path = path
+        self.load = load
+        self.check_interval = check_interval
+        self.value = None
+        self.mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    # the current value; `force` skips the check interval
+    def get(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return self.value
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                self.value = None
+                self.mtime = None
+                return None
+            if mtime != self.mtime:
+                self.value = self.load(self.path)
+                self.mtime = mtime
+            return self.value
+
+    # changes whenever a rewritten file is loaded, None while there is none
+    @property
+    def version(self):
+        self.get()
+        return self.mtime
+
+
+def load_json(path):
+    with open(path, "rt") as f:
+        return json.load(f)
+
+
+class FileCounters:
+    """Counters kept in a small JSON file, shared by every process on the host.
+
+    Lets the app processes of the `memory` backend see the generation bumped by a
+    `flask reindex` or `flask sync` run from another process. The file is reread at most
+    every `check_interval` seconds.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self._file = PolledFile(path, load_json, check_interval)
+        self._lock = threading.Lock()
+
+    def get_counter(self, name):
+        return (self._file.get() or {}).get(name, 0)
+
+    # the new value is a timestamp rather than the old one plus one, so two processes
+    # bumping at the same time still both end up with a value nobody has seen before
+    def incr_counter(self, name):
+        with self._lock:
+            values = dict(self._file.get(force=True) or {})
+            values[name] = max(values.get(name, 0) + 1, time.time_ns())
+            with open(f"{self.path}.{os.getpid()}.tmp", "wt") as f:
+                json.dump(values, f)
+            os.replace(f"{self.path}.{os.getpid()}.tmp", self.path)
+            self._file.get(force=True)
+            return values[name]
+
+
+def make_backend():
+    backend = os.getenv("SEARCH_CACHE_BACKEND", "memory")
+    if backend == "memory":
+        return MemoryBackend(maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "1024")))
+    if backend == "redis":
+        return RedisBackend(os.getenv("SEARCH_CACHE_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown cache backend '{backend}'.")
+
+
+# where the index generation is kept: in the backend when it is shared (redis), in a
+# generation file when one is configured for the memory backend, else in the process
+def make_counters(backend):
+    path = os.getenv("SEARCH_CACHE_GENERATION_FILE")
+    if path and isinstance(backend, MemoryBackend):
+        return FileCounters(path)
+    return backend
+
+
+class QueryCache:
+    """Caches responses by normalized request, invalidated when the index generation changes."""
+
+    # `counters` holds the generation counter when entries live in a separate `backend`
+    def __init__(self, backend, ttl=60, namespace="search", counters=None):
+        self.backend = backend
+        self.counters = counters or backend
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self):
+        return self.counters.get_counter("generation")
+
+    # called whenever the indexed documents change; all earlier entries stop matching
+    def bump_generation(self):
+        return self.counters.incr_counter("generation")
+
+    def key(self, parts):
+        raw = json.dumps([self.namespace, self.generation(), parts], sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, parts, record=True):
+        value = self.backend.get(self.key(parts))
+        if not record:
+            return value
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, parts, value):
+        self.backend.set(self.key(parts), value, ttl=self.ttl)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "generation": self.generation(),
+        }
+
+
+class EmbeddingCache:
+    """Query-side sparse token weights keyed by model ID and normalized query text.
+
+    Unlike QueryCache entries these do not depend on the indexed documents, only on the
+    model, so they survive reindexes and can be warmed offline into a snapshot file.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.backend = MemoryBackend(maxsize=maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_id, text):
+        value = self.backend.get(f"{model_id}:{text}")
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, model_id, text, tokens):
+        self.backend.set(f"{model_id}:{text}", tokens)
+
+    # snapshot layout: {model_id: {normalized query: {token: weight}}}
+    def load(self, path):
+        with open(path, "rt") as f:
+            snapshot = json.load(f)
+        for model_id, queries in snapshot.items():
+            for text, tokens in queries.items():
+                self.set(model_id, text, tokens)
+        return sum(len(queries) for queries in snapshot.values())
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.backend)}
+
+
+class SingleFlight:
+    """Merges concurrent calls with the same key into one, across threads and event loops."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.merged = 0
+
+    # `fn` is a coroutine function; only the first caller for a key runs it, the others
+    # wait for its result
+    async def run(self, key, fn):
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        # BaseException too: a cancelled or timed out leader must still release the key
+        try:
+            result = await fn()
+        except BaseException as exc:
+            self._finish(key, future, exc=exc)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    # the same for synchronous callers, `fn` is a plain function
+    def call(self, key, fn):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        # BaseException too: a cancelled or timed out leader must still release the key
+        try:
+            result = fn()
+        except BaseException as exc:
+            self._finish(key, future, exc=exc)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.merged += 1
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key, future, result=None, exc=None):
+        with self._lock:
+            del self._calls[key]
+        if exc is not None and not isinstance(exc, Exception):
+            # the waiters were not cancelled themselves, they only lost their result
+            aborted = RuntimeError(f"The shared call was aborted ({type(exc).__name__}).")
+            aborted.__cause__ = exc
+            exc = aborted
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
@@ -0,0 +1,173 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# model states that can be deployed as they are, without registering the model again
+DEPLOYABLE_STATES = {"REGISTERED", "UNDEPLOYED", "DEPLOY_FAILED", "PARTIALLY_DEPLOYED"}
+# states the cluster is still moving out of on its own
+TRANSITIONAL_STATES = {"REGISTERING", "DEPLOYING"}
+TASK_DONE_STATES = {"COMPLETED", "FAILED", "CANCELLED", "COMPLETED_WITH_ERROR"}
+
+
+class DeploymentError(Exception):
+    pass
+
+
+class ModelDeployer:
+    """Registers and deploys several ML models concurrently.
+
+    Each model goes its own way: an already deployed model is left alone, a registered
+    one is only deployed, and anything else is undeployed if needed, deleted and
+    registered again. Tasks are polled with a backoff that starts short and grows up to
+    `max_interval`, and every model has to be deployed within `timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        client,
+        model_group_id,
+        lookup,
+        registry=None,
+        timeout=1800,
+        min_interval=1.0,
+        max_interval=15.0,
+    ):
+        self.client = client
+        self.model_group_id = model_group_id
+        self.lookup = lookup
+        self.registry = registry
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.status = {}
+        self._lock = threading.Lock()
+        self._started = None
+
+    def request(self, method, path, body=None):
+        return self.client.transport.perform_request(method, path, body=body)
+
+    # one line with the progress of every model, printed whenever one of them changes
+    def report(self, model_name, status):
+        with self._lock:
+            if self.status.get(model_name) == status:
+                return
+            self.status[model_name] = status
+            elapsed = time.monotonic() - self._started
+            line = " | ".join(f"{name}: {state}" for name, state in self.status.items())
+            print(f"[{elapsed:6.1f}s] {line}")
+
+    def remaining(self):
+        return self._started + self.timeout - time.monotonic()
+
+    # poll until `check` returns a value, sleeping a little longer after every miss
+    def wait(self, check, what):
+        interval = self.min_interval
+        while True:
+            result = check()
+            if result is not None:
+                return result
+            remaining = self.remaining()
+            if remaining <= 0:
+                raise DeploymentError(f"Timed out waiting for {what}.")
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 1.5, self.max_interval)
+
+    def wait_for_task(self, task_id, model_name, action):
+        def check():
+            task = self.request("GET", f"/_plugins/_ml/tasks/{task_id}")
+            if task["state"] in TASK_DONE_STATES:
+                return task
+            self.report(model_name, f"{action} ({task['state'].lower()})")
+            return None
+
+        task = self.wait(check, f"task {task_id} of '{model_name}'")
+        if task["state"] != "COMPLETED":
+            raise DeploymentError(
+                f"{action.capitalize()} '{model_name}' ended as {task['state']}: {task.get('error')}"
+            )
+        return task
+
+    def model_state(self, model_id):
+        return self.request("GET", f"/_plugins/_ml/models/{model_id}").get("model_state")
+
+    def existing_model(self, model_name):
+        try:
+            return self.lookup(model_name)
+        except ValueError:
+            return None
+
+    def register(self, model_name, version):
+        self.report(model_name, "registering")
+        response = self.request(
+            "POST",
+            "/_plugins/_ml/models/_register",
+            body={
+                "name": model_name,
+                "version": version,
+                "model_group_id": self.model_group_id,
+                "model_format": "TORCH_SCRIPT",
+            },
+        )
+        return self.wait_for_task(response["task_id"], model_name, "registering")["model_id"]
+
+    def deploy(self, model_name, model_id):
+        self.report(model_name, "deploying")
+        response = self.request("POST", f"/_plugins/_ml/models/{model_id}/_deploy")
+        self.wait_for_task(response["task_id"], model_name, "deploying")
+
+    def remove(self, model_name, model_id, state):
+        if self.registry is not None:
+            # the cached ID is about to be deleted and replaced
+            self.registry.invalidate(model_name)
+        if state in ("DEPLOYED", "PARTIALLY_DEPLOYED", "DEPLOYING"):
+            self.report(model_name, "undeploying")
+            self.request("POST", f"/_plugins/_ml/models/{model_id}/_undeploy")
+        self.report(model_name, "deleting")
+        self.request("DELETE", f"/_plugins/_ml/models/{model_id}")
+
+    def deploy_model(self, model_name, version):
+        self.report(model_name, "checking")
+        model_id = self.existing_model(model_name)
+        state = self.model_state(model_id) if model_id else None
+        if state in TRANSITIONAL_STATES:
+            # another deployment is in progress, let it settle
+            self.report(model_name, state.lower())
+
+            def settled():
+                current = self.model_state(model_id)
+                return None if current in TRANSITIONAL_STATES else current
+
+            state = self.wait(settled, f"'{model_name}' to leave {state}")
+        if state == "DEPLOYED":
+            self.report(model_name, "deployed")
+            return model_id
+        if state not in DEPLOYABLE_STATES:
+            if model_id:
+                self.remove(model_name, model_id, state)
+            model_id = self.register(model_name, version)
+        self.deploy(model_name, model_id)
+        if self.registry is not None:
+            self.registry.refresh(model_name)
+        self.report(model_name, "deployed")
+        return model_id
+
+    # models are {name: version}; returns {name: model ID} once all of them are deployed
+    def run(self, models):
+        self._started = time.monotonic()
+        self.status = {model_name: "pending" for model_name in models}
+        with ThreadPoolExecutor(max_workers=len(models)) as executor:
+            futures = {
+                model_name: executor.submit(self.deploy_model, model_name, version)
+                for model_name, version in models.items()
+            }
+        model_ids = {}
+        errors = []
+        for model_name, future in futures.items():
+            try:
+                model_ids[model_name] = future.result()
+            except Exception as exc:
+                self.report(model_name, "failed")
+                errors.append(f"{model_name}: {exc}")
+        if errors:
+            raise DeploymentError("; ".join(errors))
+        return model_ids
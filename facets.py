@@ -0,0 +1,136 @@
+import json
+import os
+
+from cache import PolledFile, load_json
+
+FACET_AGGS = {
+    "category-agg": {
+        "terms": {
+            "field": "category.keyword",
+        }
+    },
+    "year-agg": {
+        "date_histogram": {
+            "field": "updated_at",
+            "calendar_interval": "year",
+            "format": "yyyy",
+        },
+    },
+}
+
+# FACET_AGGS over the whole index, plus the same tables under every category and every
+# year, so one request yields the facets of match_all and of each single-filter view
+SNAPSHOT_AGGS = {
+    **FACET_AGGS,
+    "by-category": {
+        "terms": {"field": "category.keyword", "size": 10000},
+        "aggs": {"year-agg": FACET_AGGS["year-agg"]},
+    },
+    "by-year": {
+        "date_histogram": FACET_AGGS["year-agg"]["date_histogram"],
+        "aggs": {"category-agg": FACET_AGGS["category-agg"]},
+    },
+}
+
+
+def process_aggregations(aggregations):
+    return {
+        "Category": {
+            bucket["key"]: bucket["doc_count"]
+            for bucket in aggregations["category-agg"]["buckets"]
+        },
+        "Year": {
+            bucket["key_as_string"]: bucket["doc_count"]
+            for bucket in aggregations["year-agg"]["buckets"]
+            if bucket["doc_count"] > 0
+        },
+    }
+
+
+# the facets {"total", "aggs"} of the landing view and of every view filtered by one
+# category or one year, keyed like snapshot_key, from a SNAPSHOT_AGGS response
+def facet_views(response):
+    aggregations = response["aggregations"]
+    views = {
+        "": {
+            "total": response["hits"]["total"]["value"],
+            "aggs": process_aggregations(aggregations),
+        }
+    }
+    for bucket in aggregations["by-category"]["buckets"]:
+        views[f"category:{bucket['key']}"] = {
+            "total": bucket["doc_count"],
+            "aggs": {
+                "Category": {bucket["key"]: bucket["doc_count"]},
+                "Year": process_aggregations(
+                    {"category-agg": {"buckets": []}, "year-agg": bucket["year-agg"]}
+                )["Year"],
+            },
+        }
+    for bucket in aggregations["by-year"]["buckets"]:
+        if bucket["doc_count"] == 0:
+            continue
+        views[f"year:{bucket['key_as_string']}"] = {
+            "total": bucket["doc_count"],
+            "aggs": {
+                "Category": process_aggregations(
+                    {"category-agg": bucket["category-agg"], "year-agg": {"buckets": []}}
+                )["Category"],
+                "Year": {bucket["key_as_string"]: bucket["doc_count"]},
+            },
+        }
+    return views
+
+
+# snapshot key of filter clauses from extract_filters, None unless they are nothing but
+# one category or one year
+def snapshot_key(filters):
+    if filters.get("must_not"):
+        return None
+    clauses = filters.get("filter", [])
+    if not clauses:
+        return ""
+    if len(clauses) > 1:
+        return None
+    clause = clauses[0]
+    term = clause.get("term", {}).get("category.keyword")
+    if term is not None:
+        return f"category:{term['value']}"
+    bounds = clause.get("range", {}).get("updated_at")
+    if bounds and bounds.get("gte") == bounds.get("lte") and bounds["gte"].endswith("||/y"):
+        return f"year:{bounds['gte'][:-4]}"
+    return None
+
+
+def load_views(path):
+    return load_json(path)["views"]
+
+
+def save_snapshot(path, views):
+    with open(f"{path}.tmp", "wt") as f:
+        json.dump({"views": views}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class FacetSnapshot:
+    """Serves facets precomputed at reindex time, reloading them when the file is rewritten."""
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self._file = PolledFile(path, load_views, check_interval)
+        self.hits = 0
+
+    @property
+    def version(self):
+        return self._file.version
+
+    # facets of a filter-only view, None when the snapshot does not cover it
+    def get(self, filters):
+        views = self._file.get()
+        key = snapshot_key(filters)
+        if views is None or key is None:
+            return None
+        facets = views.get(key)
+        if facets is not None:
+            self.hits += 1
+        return facets
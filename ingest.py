@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from opensearchpy.exceptions import TransportError
+
+
+# yield documents one at a time from a JSON array or a JSON Lines file
+def iter_documents(path, chunk_size=1 << 16):
+    decoder = json.JSONDecoder()
+    with open(path, "rt") as f:
+        buffer = f.read(chunk_size)
+        pos = len(buffer) - len(buffer.lstrip())
+        is_array = buffer[pos:pos + 1] == "["
+        if is_array:
+            pos += 1
+        while True:
+            # skip whitespace (JSON Lines) and separators (JSON array) between documents
+            while pos < len(buffer) and (buffer[pos].isspace() or (is_array and buffer[pos] == ",")):
+                pos += 1
+            if pos == len(buffer):
+                buffer = f.read(chunk_size)
+                pos = 0
+                if not buffer:
+                    return
+                continue
+            if is_array and buffer[pos] == "]":
+                return
+            try:
+                document, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # the document spans the end of the buffer, read more and retry
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield document
+            pos = end
+            if pos >= chunk_size:
+                buffer = buffer[pos:]
+                pos = 0
+
+
+# stable ID, so re-ingesting a document overwrites it: derived from the document URL, or
+# from its name and content fingerprint when it has no URL (names are not unique)
+def document_id(document):
+    key = document.get("url") or f"{document.get('name', '')}\n{content_hash(document)}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+# fingerprint of the name, summary and content plus the remaining metadata, so any edit
+# that would change the stored document is detected
+def content_hash(document):
+    fields = {
+        key: value for key, value in document.items() if key not in ("doc_id", "content_hash")
+    }
+    return hashlib.sha256(
+        json.dumps(fields, sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+def index_operation(index, document):
+    id = document_id(document)
+    source = dict(document, doc_id=id, content_hash=content_hash(document))
+    return {"index": {"_index": index, "_id": id}}, source
+
+
+def delete_operation(index, id):
+    return {"delete": {"_index": index, "_id": id}}, None
+
+
+# group bulk operations into batches bounded by operation count and payload size;
+# each item is an (action, source) pair of already serialized lines, source is None for deletes
+def batch_operations(operations, max_docs=500, max_bytes=5 * 1024 * 1024):
+    batch = []
+    batch_bytes = 0
+    for action, source in operations:
+        action = json.dumps(action)
+        source = json.dumps(source) if source is not None else None
+        size = len(action.encode()) + (len(source.encode()) + 1 if source else 0) + 1
+        if batch and (len(batch) >= max_docs or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append((action, source))
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+# index operations of a document stream; a document whose ID was already seen in the run
+# would overwrite the earlier one, so it is reported, counted in counts["duplicates"] and
+# left out
+def index_operations(documents, index, counts):
+    seen = set()
+    for document in documents:
+        operation = index_operation(index, document)
+        id = operation[0]["index"]["_id"]
+        if id in seen:
+            report_duplicate(document, id, counts)
+            continue
+        seen.add(id)
+        yield operation
+
+
+def report_duplicate(document, id, counts):
+    counts["duplicates"] += 1
+    print(f"Skipping duplicate document '{document.get('name')}' (ID {id} already ingested)")
+
+
+def batch_documents(documents, index, counts=None, max_docs=500, max_bytes=5 * 1024 * 1024):
+    counts = {"duplicates": 0} if counts is None else counts
+    operations = index_operations(documents, index, counts)
+    return batch_operations(operations, max_docs=max_docs, max_bytes=max_bytes)
+
+
+# compare a document stream with the indexed {id: content_hash} state and yield only the
+# operations needed to bring the index up to date; `counts` is filled in as a side effect
+def sync_operations(documents, indexed, index, counts):
+    seen = set()
+    for document in documents:
+        operation = index_operation(index, document)
+        id = operation[0]["index"]["_id"]
+        if id in seen:
+            report_duplicate(document, id, counts)
+            continue
+        seen.add(id)
+        if id not in indexed:
+            counts["new"] += 1
+        elif indexed[id] != operation[1]["content_hash"]:
+            counts["changed"] += 1
+        else:
+            counts["unchanged"] += 1
+            continue
+        indexed[id] = operation[1]["content_hash"]
+        yield operation
+    for id in [id for id in indexed if id not in seen]:
+        counts["deleted"] += 1
+        del indexed[id]
+        yield delete_operation(index, id)
+
+
+def load_manifest(path):
+    try:
+        with open(path, "rt") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_manifest(path, indexed):
+    with open(f"{path}.tmp", "wt") as f:
+        json.dump(indexed, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class BulkIngester:
+    """Sends bulk batches from a worker pool, retrying rejections with backoff."""
+
+    def __init__(self, client, workers=4, max_retries=5, backoff=1.0, request_timeout=120):
+        self.client = client
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.request_timeout = request_timeout
+        self._lock = threading.Lock()
+
+    def run(self, batches):
+        self.stats = {"documents": 0, "errors": 0, "batches": 0, "bytes": 0}
+        failures = []
+        # backpressure: never read more than two batches per worker ahead of the cluster
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def done(future):
+            if future.exception():
+                failures.append(future.exception())
+            slots.release()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for number, batch in enumerate(batches, start=1):
+                slots.acquire()
+                if failures:
+                    slots.release()
+                    break
+                executor.submit(self.send_batch, number, batch).add_done_callback(done)
+        if failures:
+            raise failures[0]
+        elapsed = time.perf_counter() - start
+        self.stats["took"] = int(elapsed * 1000)
+        self.stats["docs_per_second"] = self.stats["documents"] / elapsed if elapsed else 0.0
+        return self.stats
+
+    def send_batch(self, number, batch):
+        start = time.perf_counter()
+        pending = batch
+        errors = 0
+        for attempt in range(self.max_retries + 1):
+            body = "".join(
+                f"{action}\n{source}\n" if source is not None else f"{action}\n"
+                for action, source in pending
+            )
+            try:
+                response = self.client.bulk(body=body, request_timeout=self.request_timeout)
+            except TransportError as exc:
+                if exc.status_code != 429 or attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            # retry only the items the cluster rejected as too many requests
+            rejected = []
+            if response.get("errors"):
+                for item, pair in zip(response["items"], pending):
+                    result = next(iter(item.values()))
+                    if result.get("status") == 429:
+                        rejected.append(pair)
+                    elif "delete" in item and result.get("status") == 404:
+                        continue
+                    elif "error" in result:
+                        errors += 1
+                        print(f"Failed to index document: {result['error']}")
+            if not rejected:
+                break
+            if attempt == self.max_retries:
+                errors += len(rejected)
+                break
+            pending = rejected
+            time.sleep(self.backoff * 2 ** attempt)
+        elapsed = time.perf_counter() - start
+        size = sum(len(action) + len(source or "") + 2 for action, source in batch)
+        with self._lock:
+            self.stats["documents"] += len(batch) - errors
+            self.stats["errors"] += errors
+            self.stats["batches"] += 1
+            self.stats["bytes"] += size
+        print(
+            f"Batch {number}: {len(batch)} documents in {elapsed:.2f}s "
+            f"({len(batch) / max(elapsed, 1e-6):.1f} docs/s)"
+        )
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# seconds; spans cached hits (sub-millisecond) up to slow hybrid queries
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    labels = format_labels(self.labels + ("le",), label_values + (str(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(
+    Histogram("search_app_request_seconds", "Time to handle a request.", labels=("endpoint",))
+)
+REQUESTS = registry.register(
+    Counter("search_app_requests_total", "Handled requests.", labels=("endpoint", "status"))
+)
+# filter_parsing, model_id, query_tokens, opensearch, post_processing, render
+STAGE_SECONDS = registry.register(
+    Histogram("search_app_stage_seconds", "Time spent in one stage of a request.", labels=("stage",))
+)
+OPENSEARCH_TOOK_SECONDS = registry.register(
+    Histogram(
+        "search_app_opensearch_took_seconds",
+        "Server-side query time reported by OpenSearch in `took`.",
+        labels=("operation",),
+    )
+)
+SLOW_QUERIES = registry.register(
+    Counter("search_app_slow_queries_total", "Queries slower than SLOW_QUERY_MS.", labels=("operation",))
+)
+
+
+def stage(name):
+    return STAGE_SECONDS.time(name)
+
+
+class SlowQueryLog:
+    """Logs the full body of a sampled share of the queries slower than a threshold."""
+
+    def __init__(self, threshold_ms=500, sample_rate=1.0, logger=None):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.logger = logger or logging.getLogger("search.slow")
+
+    def record(self, operation, body, elapsed, took_ms=None):
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms < self.threshold_ms:
+            return
+        SLOW_QUERIES.inc(operation)
+        if random.random() >= self.sample_rate:
+            return
+        self.logger.warning(
+            "slow %s: %.1f ms (took %s ms) %s",
+            operation,
+            elapsed_ms,
+            took_ms,
+            json.dumps(body, default=str),
+        )
+
+
+slow_queries = SlowQueryLog(
+    threshold_ms=float(os.getenv("SLOW_QUERY_MS", "500")),
+    sample_rate=float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1.0")),
+)
+
+
+# round trip and server `took` of an OpenSearch response, plus the slow-query log
+def record_query(operation, body, elapsed, response):
+    STAGE_SECONDS.observe(elapsed, "opensearch")
+    took_ms = response.get("took") if isinstance(response, dict) else None
+    if took_ms is not None:
+        OPENSEARCH_TOOK_SECONDS.observe(took_ms / 1000, operation)
+    slow_queries.record(operation, body, elapsed, took_ms)
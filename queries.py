@@ -0,0 +1,301 @@
+import re
+from functools import lru_cache
+
+from cache import MemoryBackend
+
+# one pass over the query: an optionally negated field filter with a quoted or bare value,
+# a quoted phrase, or a plain word
+QUERY_TOKEN_REGEX = re.compile(
+    r'(?P<negate>-)?(?P<field>category|year):(?:"(?P<quoted>[^"]*)"?|(?P<value>\S+))'
+    r'|"(?P<phrase>[^"]*)"?'
+    r"|(?P<word>\S+)"
+)
+VALUE_SEPARATOR_REGEX = re.compile(r"[,|]")
+# 2021, 2019..2021, 2019.. or ..2021
+YEAR_REGEX = re.compile(r"(?P<start>\d{4})?(?:(?P<range>\.\.)(?P<end>\d{4})?)?")
+PHRASE_FIELDS = ["name", "summary", "content"]
+
+
+def category_clause(values):
+    if len(values) == 1:
+        return {"term": {"category.keyword": {"value": values[0]}}}
+    return {"terms": {"category.keyword": values}}
+
+
+def year_range(value):
+    match = YEAR_REGEX.fullmatch(value)
+    if not match or not (match.group("start") or match.group("end")):
+        return None
+    start, end = match.group("start"), match.group("end")
+    bounds = {}
+    if start:
+        bounds["gte"] = f"{start}||/y"
+    if end or not match.group("range"):
+        bounds["lte"] = f"{end or start}||/y"
+    return {"range": {"updated_at": bounds}}
+
+
+def year_clause(ranges):
+    if len(ranges) == 1:
+        return ranges[0]
+    return {"bool": {"should": ranges, "minimum_should_match": 1}}
+
+
+# split field filters and quoted phrases off the query text. Values of one field are OR'd,
+# whether they are repeated (category:a category:b) or listed (category:a,b or a|b);
+# different fields and phrases are AND'ed, and a leading "-" excludes the values instead.
+# The result is cached and shared between requests, so it must not be modified.
+@lru_cache(maxsize=4096)
+def extract_filters(query):
+    values = {}
+    phrases = []
+    words = []
+    for match in QUERY_TOKEN_REGEX.finditer(query):
+        field = match.group("field")
+        if field:
+            raw = match.group("quoted")
+            if raw is None:
+                raw = match.group("value")
+                parts = [part for part in VALUE_SEPARATOR_REGEX.split(raw) if part]
+            else:
+                parts = [raw] if raw else []
+            if field == "year":
+                ranges = [year_range(part) for part in parts]
+                if not ranges or None in ranges:
+                    # not a year filter after all, keep it as text
+                    words.append(match.group(0))
+                    continue
+                parts = ranges
+            key = (field, bool(match.group("negate")))
+            for part in parts:
+                if part not in values.setdefault(key, []):
+                    values[key].append(part)
+        elif match.group("phrase") is not None:
+            if match.group("phrase").strip():
+                phrases.append(match.group("phrase"))
+                words.append(match.group("phrase"))
+        else:
+            words.append(match.group("word"))
+
+    filters = []
+    must_not = []
+    for (field, negate), parts in values.items():
+        if not parts:
+            continue
+        clause = category_clause(parts) if field == "category" else year_clause(parts)
+        (must_not if negate else filters).append(clause)
+    for phrase in phrases:
+        filters.append({"multi_match": {"query": phrase, "type": "phrase", "fields": PHRASE_FIELDS}})
+    clauses = {"filter": filters}
+    if must_not:
+        clauses["must_not"] = must_not
+    return clauses, " ".join(words)
+
+
+# hybrid subqueries are fetched in windows of this many results per shard; the depth must
+# stay the same across the pages of a window for the fused ranking to be stable
+PAGINATION_WINDOW = 50
+
+
+def pagination_depth(from_, size):
+    return -(-(from_ + size) // PAGINATION_WINDOW) * PAGINATION_WINDOW
+
+
+def lexical_query(parsed_query, filters):
+    return {
+        "bool": {
+            "must": [
+                {
+                    "multi_match": {
+                        "query": parsed_query,
+                        "fields": ["name", "summary", "content"],
+                    }
+                }
+            ],
+            **filters,
+        }
+    }
+
+
+# with precomputed query_tokens the cluster skips running the sparse encoding model
+def neural_query(parsed_query, filters, model_id, query_tokens=None):
+    if query_tokens:
+        sparse_query = {"query_tokens": query_tokens}
+    else:
+        sparse_query = {"query_text": parsed_query, "model_id": model_id}
+    return {
+        "bool": {
+            "must": [
+                {
+                    "neural_sparse": {
+                        "summary_sparse_embedding": sparse_query,
+                    }
+                }
+            ],
+            **filters,
+        }
+    }
+
+
+# k-NN over the dense summary embeddings; filters are applied during the graph search
+# (lucene engine) so filtered queries still get k neighbours
+def dense_query(parsed_query, filters, model_id, k):
+    neural = {"query_text": parsed_query, "model_id": model_id, "k": k}
+    if any(filters.values()):
+        neural["filter"] = {"bool": filters}
+    return {"neural": {"summary_dense_embedding": neural}}
+
+
+def subquery(name, parsed_query, filters, model_ids, depth, query_tokens=None):
+    if name == "lexical":
+        return lexical_query(parsed_query, filters)
+    if name == "sparse":
+        return neural_query(parsed_query, filters, model_ids.get("sparse"), query_tokens)
+    if name == "dense":
+        return dense_query(parsed_query, filters, model_ids.get("dense"), depth)
+    raise ValueError(f"Unknown subquery '{name}'.")
+
+
+# model_ids used to be the sparse model ID alone; both forms are accepted
+def as_model_ids(model_id):
+    return model_id if isinstance(model_id, dict) else {"sparse": model_id}
+
+
+# the query behind a results page: the subqueries of the retrieval mode for text (combined
+# in a hybrid query when there are several), match_all for browsing
+def build_search_query(
+    parsed_query,
+    filters,
+    model_id=None,
+    depth=PAGINATION_WINDOW,
+    query_tokens=None,
+    subqueries=("lexical", "sparse"),
+):
+    if not parsed_query.strip():
+        return {"bool": {"must": [{"match_all": {}}], **filters}}
+    model_ids = as_model_ids(model_id)
+    queries = [
+        subquery(name, parsed_query, filters, model_ids, depth, query_tokens)
+        for name in subqueries
+    ]
+    if len(queries) == 1:
+        return queries[0]
+    # combine the subqueries in a hybrid query
+    return {
+        "hybrid": {
+            "queries": queries,
+            "pagination_depth": depth,  #It specifies the maximum number of search results to retrieve from each shard for every subquery.
+        }
+    }
+
+
+# matches the same documents as build_search_query (for hybrid: the union of the
+# subqueries) without hybrid pagination, for aggregations and totals
+def build_facet_query(
+    parsed_query,
+    filters,
+    model_id=None,
+    query_tokens=None,
+    subqueries=("lexical", "sparse"),
+    depth=PAGINATION_WINDOW,
+):
+    if not parsed_query.strip():
+        return {"bool": {"must": [{"match_all": {}}], **filters}}
+    model_ids = as_model_ids(model_id)
+    return {
+        "bool": {
+            "should": [
+                subquery(name, parsed_query, filters, model_ids, depth, query_tokens)
+                for name in subqueries
+            ]
+        }
+    }
+
+
+# built results-page and facet queries by whitespace-normalized query string. Token weights
+# are a function of the model and the query text, so whether they were available is
+# enough to tell the bodies apart
+_query_bodies = MemoryBackend(maxsize=1024)
+
+
+# (search query, facet query) for a raw query string, memoized so repeated queries reuse
+# the nested hybrid, lexical and neural bodies; the results are shared, do not modify them
+def query_bodies(
+    query,
+    model_id=None,
+    depth=PAGINATION_WINDOW,
+    query_tokens=None,
+    subqueries=("lexical", "sparse"),
+):
+    model_ids = as_model_ids(model_id)
+    key = (
+        " ".join(query.split()),
+        tuple(sorted(model_ids.items())),
+        depth,
+        query_tokens is not None,
+        tuple(subqueries),
+    )
+    bodies = _query_bodies.get(key)
+    if bodies is None:
+        filters, parsed_query = extract_filters(key[0])
+        bodies = (
+            build_search_query(parsed_query, filters, model_ids, depth, query_tokens, subqueries),
+            build_facet_query(parsed_query, filters, model_ids, query_tokens, subqueries, depth),
+        )
+        _query_bodies.set(key, bodies)
+    return bodies
+
+
+def search_as_you_type_clause(field, search_term, boost=1.0):
+    return {
+        "multi_match": {
+            "query": search_term,
+            "type": "bool_prefix",
+            "fields": [f"{field}.suggest", f"{field}.suggest._2gram", f"{field}.suggest._3gram"],
+            "boost": boost,
+        }
+    }
+
+
+# best matching documents collapsed to the top hits per category. The "prefix" mode
+# expands the last term over the text fields at query time with match_bool_prefix; the
+# "search_as_you_type" mode matches the edge n-gram subfields of name, category and
+# summary, whose prefixes were indexed ahead of time, and leaves out content
+def autocomplete_query(search_term, size=10, collapse_size=5, mode="prefix"):
+    if mode == "search_as_you_type":
+        clauses = [
+            search_as_you_type_clause("name", search_term, boost=1.2),
+            search_as_you_type_clause("category", search_term),
+            search_as_you_type_clause("summary", search_term),
+        ]
+    elif mode == "prefix":
+        clauses = [
+            {"match_bool_prefix": {"name": {"query": search_term, "boost": 1.2}}},
+            {"match_bool_prefix": {"category": {"query": search_term}}},
+            {"match_bool_prefix": {"summary": {"query": search_term}}},
+            {"match_bool_prefix": {"content": {"query": search_term, "boost": 0.5}}},
+        ]
+    else:
+        raise ValueError(f"Unknown autocomplete mode '{mode}'.")
+    return {
+        "from": 0,
+        "size": size,
+        "query": {
+            "dis_max": {
+                "queries": clauses,
+                "tie_breaker": 0.7,
+            }
+        },
+        "fields": ["name", "category"],
+        "_source": False,
+        "collapse": {
+            "field": "category.keyword",
+            "inner_hits": {
+                "name": "category_hits",
+                "size": collapse_size,
+                # summary lets cached suggestions be narrowed down for longer prefixes
+                "fields": ["name", "summary"],
+                "_source": False,
+            },
+        },
+    }
@@ -0,0 +1,72 @@
+import gzip
+import hashlib
+import json
+
+from flask import Response
+
+# optional accelerators: orjson serializes several times faster than json, brotli
+# compresses text smaller than gzip; both fall back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript")
+# below this the compression headers cost about as much as they save
+MIN_COMPRESS_SIZE = 512
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype="application/json")
+
+
+# a weak ETag (compressed and identity bodies of one resource differ byte for byte) for a
+# response that only changes with the index generation and the given request parts
+def etag_for(generation, parts):
+    raw = json.dumps([generation, parts], sort_keys=True)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def set_cache_headers(response, etag=None, max_age=0):
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+
+def not_modified(etag, max_age=0):
+    return set_cache_headers(Response(status=304), etag, max_age)
+
+
+# compress a buffered response with the best encoding the client accepts
+def compress(response, accept_encodings, level=5):
+    response.vary.add("Accept-Encoding")
+    if (
+        response.direct_passthrough
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+    # the negotiated quality, so "gzip;q=0" or "*;q=0" refuse an encoding
+    if brotli is not None and accept_encodings["br"] > 0:
+        response.set_data(brotli.compress(data, quality=level))
+        response.headers["Content-Encoding"] = "br"
+    elif accept_encodings["gzip"] > 0:
+        response.set_data(gzip.compress(data, compresslevel=level))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
@@ -0,0 +1,99 @@
+from functools import lru_cache
+
+from queries import pagination_depth
+
+SUBQUERIES = ("lexical", "sparse", "dense")
+# server-side fusion runs the subqueries as one hybrid query through a search pipeline
+# created by `flask create-pipelines`; "local" fetches each subquery's ranking on its own
+# and fuses them in the app with reciprocal rank fusion
+FUSION_PIPELINES = {"rrf": "rrf-pipeline", "weighted": "weighted-pipeline"}
+FUSIONS = tuple(FUSION_PIPELINES) + ("local",)
+# how deep each subquery is read; local fusion moves every list to the app, so it stops earlier
+DEFAULT_MAX_DEPTH = {"rrf": 1000, "weighted": 1000, "local": 200}
+RRF_RANK_CONSTANT = 60
+
+# named modes; anything else is parsed as "subqueries[/fusion[/max depth]]",
+# e.g. "lexical,dense/local/100"
+PRESETS = {
+    "hybrid": "lexical,sparse/rrf",
+    "lexical": "lexical",
+    "sparse": "sparse",
+    "dense": "dense",
+    "hybrid-dense": "lexical,sparse,dense/rrf",
+    "weighted": "lexical,sparse,dense/weighted",
+    "local": "lexical,sparse,dense/local",
+}
+
+
+class RetrievalMode:
+    """Which subqueries rank the results, how their rankings are fused and how deep."""
+
+    def __init__(self, subqueries, fusion="rrf", max_depth=None):
+        unknown = [name for name in subqueries if name not in SUBQUERIES]
+        if not subqueries or unknown:
+            raise ValueError(f"Subqueries must be some of {', '.join(SUBQUERIES)}.")
+        if fusion not in FUSIONS:
+            raise ValueError(f"Unknown fusion '{fusion}', expected one of {', '.join(FUSIONS)}.")
+        self.subqueries = tuple(subqueries)
+        self.fusion = fusion
+        self.max_depth = max_depth or DEFAULT_MAX_DEPTH[fusion]
+
+    def __repr__(self):
+        return f"{','.join(self.subqueries)}/{self.fusion}/{self.max_depth}"
+
+    @property
+    def fused(self):
+        return len(self.subqueries) > 1
+
+    # search pipeline for server-side fusion, None when the query is a single subquery or
+    # the rankings are fused locally
+    @property
+    def pipeline(self):
+        if not self.fused:
+            return None
+        return FUSION_PIPELINES.get(self.fusion)
+
+    @property
+    def local(self):
+        return self.fused and self.fusion == "local"
+
+    def depth(self, from_, size):
+        return min(pagination_depth(from_, size), self.max_depth)
+
+    # results past the maximum depth are not retrieved
+    def exhausted(self, from_):
+        return from_ >= self.max_depth
+
+
+@lru_cache(maxsize=64)
+def get_mode(spec):
+    spec = PRESETS.get(spec, spec)
+    subqueries, _, rest = spec.partition("/")
+    fusion, _, max_depth = rest.partition("/")
+    return RetrievalMode(
+        [name.strip() for name in subqueries.split(",") if name.strip()],
+        fusion or "rrf",
+        int(max_depth) if max_depth else None,
+    )
+
+
+# fuse the hit lists of several subqueries the way the rrf search pipeline does: every
+# document scores 1 / (rank constant + rank) in each list it appears in. Returns a search
+# response with one page of the fused ranking
+def reciprocal_rank_fusion(responses, size, from_=0, rank_constant=RRF_RANK_CONSTANT):
+    scores = {}
+    hits = {}
+    for response in responses:
+        for rank, hit in enumerate(response["hits"]["hits"], start=1):
+            scores[hit["_id"]] = scores.get(hit["_id"], 0.0) + 1.0 / (rank_constant + rank)
+            hits.setdefault(hit["_id"], hit)
+    ranked = sorted(scores, key=lambda id: (-scores[id], id))
+    page = [dict(hits[id], _score=scores[id]) for id in ranked[from_:from_ + size]]
+    return {
+        "took": max((response.get("took", 0) for response in responses), default=0),
+        "hits": {
+            "total": {"value": len(ranked), "relation": "eq"},
+            "max_score": scores[ranked[0]] if ranked else None,
+            "hits": page,
+        },
+    }
@@ -1,31 +1,230 @@
 import json
 from pprint import pprint
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
-from opensearchpy import OpenSearch
+from opensearchpy import OpenSearch, TransportError
+from opensearchpy.helpers import scan
+
+from cache import (
+    EmbeddingCache,
+    MemoryBackend,
+    QueryCache,
+    SingleFlight,
+    make_backend,
+    make_counters,
+    normalize_query,
+)
+from deploy import ModelDeployer
+from facets import SNAPSHOT_AGGS, facet_views, save_snapshot
+from ingest import (
+    BulkIngester,
+    batch_documents,
+    batch_operations,
+    iter_documents,
+    load_manifest,
+    save_manifest,
+    sync_operations,
+)
+from metrics import record_query
+from queries import extract_filters, pagination_depth, query_bodies
+from retrieval import get_mode, reciprocal_rank_fusion
+from suggest import SnapshotCollector
 
 load_dotenv()
 
+SPARSE_MODEL_NAME = "amazon/neural-sparse/opensearch-neural-sparse-encoding-v2-distill"
+DENSE_MODEL_NAME = "huggingface/sentence-transformers/all-MiniLM-L6-v2"
+# the name searches go through; an alias onto a versioned index after a zero-downtime reindex
+INDEX_NAME = "my_documents"
+# stored for ranking only, never sent back to the app
+EMBEDDING_FIELDS = ["summary_dense_embedding", "summary_sparse_embedding"]
+# the fields the document page shows
+DOCUMENT_FIELDS = ["name", "content"]
+
+
+def is_model_not_found(exc):
+    # neural queries fail with e.g. "Failed to find model" or "Model not ready yet"
+    # when the model they reference was undeployed or re-registered under a new ID
+    message = str(exc).lower()
+    return "model" in message and (
+        "not found" in message
+        or "failed to find" in message
+        or "not ready" in message
+    )
+
+
+class ModelRegistry:
+    """Resolves model names to model IDs once and keeps them in a TTL cache."""
+
+    def __init__(self, lookup, ttl=300):
+        self.lookup = lookup
+        self.ttl = ttl
+        self._ids = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, model_name):
+        with self._lock:
+            entry = self._ids.get(model_name)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return self.refresh(model_name)
+
+    def refresh(self, model_name):
+        model_id = self.lookup(model_name)
+        with self._lock:
+            self._ids[model_name] = (model_id, time.monotonic())
+        return model_id
+
+    def invalidate(self, model_name=None):
+        with self._lock:
+            if model_name is None:
+                self._ids.clear()
+            else:
+                self._ids.pop(model_name, None)
+
+    # re-resolve cached model IDs without blocking the request that hit the error
+    def refresh_in_background(self, model_names=None):
+        with self._lock:
+            if model_names is None:
+                model_names = list(self._ids)
+            model_names = [name for name in model_names if name not in self._refreshing]
+            self._refreshing.update(model_names)
+
+        def run():
+            for model_name in model_names:
+                try:
+                    self.refresh(model_name)
+                except Exception as exc:
+                    self.invalidate(model_name)
+                    print(f"Could not refresh model ID for '{model_name}': {exc}")
+                finally:
+                    with self._lock:
+                        self._refreshing.discard(model_name)
+
+        if model_names:
+            threading.Thread(target=run, daemon=True).start()
+
+
+def parse_hosts(value):
+    hosts = []
+    for host in value.split(","):
+        name, _, port = host.strip().rpartition(":")
+        hosts.append({"host": name or port, "port": int(port) if name else 9200})
+    return hosts
+
+
+def env_flag(name, default):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+# connection settings shared by the sync and async clients; requests are spread over
+# the configured hosts round-robin, and sniffing adds the rest of the cluster's nodes
+def client_options(async_client=False):
+    sniff = env_flag("OPENSEARCH_SNIFF", "0")
+    pool_size = int(os.getenv("OPENSEARCH_POOL_MAXSIZE", "10"))
+    options = dict(
+        hosts=parse_hosts(os.getenv("OPENSEARCH_HOSTS", "localhost:19200")),
+        http_compress=True,
+        http_auth=(
+            os.getenv("OPENSEARCH_ADMIN_USER"),
+            os.getenv("OPENSEARCH_INITIAL_ADMIN_PASSWORD"),
+        ),
+        use_ssl=env_flag("OPENSEARCH_USE_SSL", "1"),
+        verify_certs=False,
+        ssl_assert_hostname=False,
+        ssl_show_warn=False,
+        timeout=int(os.getenv("OPENSEARCH_TIMEOUT", "10")),
+        max_retries=int(os.getenv("OPENSEARCH_MAX_RETRIES", "3")),
+        retry_on_timeout=env_flag("OPENSEARCH_RETRY_ON_TIMEOUT", "1"),
+        sniff_on_start=sniff,
+        sniff_on_connection_fail=sniff,
+        sniffer_timeout=60 if sniff else None,
+    )
+    # the urllib3 and aiohttp connection classes name their pool size differently
+    options["maxsize" if async_client else "pool_maxsize"] = pool_size
+    return options
+
 
 class Search:
     def __init__(self):
-        self.ops = OpenSearch(
-            hosts=[{"host": "localhost", "port": 19200}],
-            http_compress=True,
-            http_auth=(
-                os.getenv("OPENSEARCH_ADMIN_USER"),
-                os.getenv("OPENSEARCH_INITIAL_ADMIN_PASSWORD"),
-            ),
-            use_ssl=True,
-            verify_certs=False,
-            ssl_assert_hostname=False,
-            ssl_show_warn=False,
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.model_ids = ModelRegistry(
+            self.lookup_model_id, ttl=int(os.getenv("MODEL_ID_CACHE_TTL", "300"))
+        )
+        # search responses keyed by normalized request, dropped when the index generation changes
+        cache_backend = make_backend()
+        counters = make_counters(cache_backend)
+        # whether every process sees the same generation, so it can be published in ETags
+        self.shared_generation = not isinstance(counters, MemoryBackend)
+        self.query_cache = QueryCache(
+            cache_backend, ttl=int(os.getenv("SEARCH_CACHE_TTL", "60")), counters=counters
+        )
+        self.facet_cache = QueryCache(
+            cache_backend,
+            ttl=int(os.getenv("FACET_CACHE_TTL", "300")),
+            namespace="facets",
+            counters=counters,
+        )
+        # sparse token weights of seen queries, so neural_sparse skips model inference
+        self.query_tokens_cache = EmbeddingCache(
+            maxsize=int(os.getenv("QUERY_TOKENS_CACHE_SIZE", "10000"))
+        )
+        snapshot = os.getenv("QUERY_TOKENS_SNAPSHOT")
+        if snapshot and os.path.exists(snapshot):
+            count = self.query_tokens_cache.load(snapshot)
+            print(f"Loaded {count} precomputed query embeddings from {snapshot}")
+        # concurrent misses for the same query share one predict call
+        self._token_flight = SingleFlight()
+        self.autocomplete_cache = QueryCache(
+            cache_backend,
+            ttl=int(os.getenv("AUTOCOMPLETE_CACHE_TTL", "30")),
+            namespace="autocomplete",
+            counters=counters,
+        )
+        # document pages by ID, in their own LRU so large documents do not evict search
+        # responses; they share the generation, so a reindex drops them too
+        self.document_cache = QueryCache(
+            MemoryBackend(maxsize=int(os.getenv("DOCUMENT_CACHE_SIZE", "512"))),
+            ttl=int(os.getenv("DOCUMENT_CACHE_TTL", "600")),
+            namespace="documents",
+            counters=counters,
         )
+        self._prefetching = set()
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=2)
+        # prefetches queued or running; while all are taken new pages skip the prefetch,
+        # so a slow cluster cannot grow the executor's queue
+        self._prefetch_slots = threading.BoundedSemaphore(4)
+        # browse sessions starting within this many seconds share one point in time
+        self.pit_reuse = int(os.getenv("BROWSE_PIT_REUSE", "60"))
+        self._pit = None
+        self._pit_lock = threading.Lock()
+
+    # the client is created on first use, so importing the app never blocks on the cluster
+    @property
+    def ops(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = OpenSearch(**client_options())
+        return self._client
+
+    def health_check(self):
         client_info = self.ops.info()
         print("Connected to Opensearch!")
         pprint(client_info)
+        health = self.ops.cluster.health()
+        print(
+            f"Cluster '{health['cluster_name']}' is {health['status']} "
+            f"with {health['number_of_nodes']} nodes."
+        )
+        return health
 
     # update cluster settings to enable model
     def update_cluster_settings(self):
@@ -80,6 +279,9 @@ class Search:
             return model_group_id  # to be changed later
 
     def get_model_id(self, model_name):
+        return self.model_ids.get(model_name)
+
+    def lookup_model_id(self, model_name):
         models = self.ops.transport.perform_request(
             "GET",
             "/_plugins/_ml/models/_search",
@@ -95,119 +297,19 @@ class Search:
         else:
             raise ValueError(f"{model_name} model not found.")
 
-    # deploy "huggingface/sentence-transformers/all-MiniLM-L6-v2" and "amazon/neural-sparse/opensearch-neural-sparse-encoding-v2-distill"
-    def deploy_models(self):
+    # register and deploy the sparse and dense models concurrently, reusing whatever is
+    # already registered or deployed; raises DeploymentError when a model cannot be deployed
+    def deploy_models(self, timeout=1800):
         model_group_id = self.register_model_group()
         print(f"Model group ID: {model_group_id}")
-        sparse_model_name = (
-            "amazon/neural-sparse/opensearch-neural-sparse-encoding-v2-distill"
+        deployer = ModelDeployer(
+            self.ops,
+            model_group_id,
+            lookup=self.lookup_model_id,
+            registry=self.model_ids,
+            timeout=timeout,
         )
-        dense_model_name = "huggingface/sentence-transformers/all-MiniLM-L6-v2"
-        model_names = [sparse_model_name, dense_model_name]
-        model_configs = {sparse_model_name: "1.0.0", dense_model_name: "1.0.2"}
-        sparse_model_id = None
-        dense_model_id = None
-        try:
-            sparse_model_id = self.get_model_id(sparse_model_name)
-            print(f"Sparse model ID: {sparse_model_id}")
-            dense_model_id = self.get_model_id(dense_model_name)
-            print(f"Dense model ID: {dense_model_id}")
-            # check if models are already deployed
-            sparse_model_is_deployed = (self.ops.transport.perform_request("GET", f"/_plugins/_ml/models/{sparse_model_id}").get("model_state")== "DEPLOYED")
-            print(f"Sparse model is deployed: {sparse_model_is_deployed}")
-            dense_model_is_deployed = (self.ops.transport.perform_request("GET", f"/_plugins/_ml/models/{dense_model_id}").get("model_state")== "DEPLOYED")
-            print(f"Dense model is deployed: {dense_model_is_deployed}")
-            if sparse_model_is_deployed and dense_model_is_deployed:
-                print("Models are already deployed.")
-                return
-            else:
-                #error out so that we can move to the except block
-                raise Exception("Models are not deployed.")
-        except Exception as exc:
-            print(exc)
-            # delete models if they exist and IDs are available
-            if sparse_model_id:
-                # undeploy the model first
-                self.ops.transport.perform_request(
-                    "POST", f"/_plugins/_ml/models/{sparse_model_id}/_undeploy"
-                )
-                print(f"Model '{sparse_model_name}' undeployed successfully.")
-                self.ops.transport.perform_request(
-                    "DELETE", f"/_plugins/_ml/models/{sparse_model_id}"
-                )
-            if dense_model_id:
-                # undeploy the model first
-                self.ops.transport.perform_request(
-                    "POST", f"/_plugins/_ml/models/{dense_model_id}/_undeploy"
-                )
-                print(f"Model '{dense_model_name}' undeployed successfully.")
-                self.ops.transport.perform_request(
-                    "DELETE", f"/_plugins/_ml/models/{dense_model_id}"
-                )
-            print("registering and deploying models...")
-            for model_name in model_names:
-                response = self.ops.transport.perform_request(
-                    "POST",
-                    "/_plugins/_ml/models/_register",
-                    body={
-                        "name": model_name,
-                        "version": model_configs[model_name],
-                        "model_group_id": model_group_id,
-                        "model_format": "TORCH_SCRIPT",
-                    },
-                )
-                task_id = response["task_id"]
-                print(
-                    f"task id: {task_id} for model '{model_name}' registration received."
-                )
-                # wait for the model to be registered
-                task_status = None
-                while task_status not in ["COMPLETED", "FAILED"]:
-                    print(
-                        f"Waiting for model '{model_name}' registration to complete..."
-                    )
-                    response = self.ops.transport.perform_request(
-                        "GET", f"/_plugins/_ml/tasks/{task_id}"
-                    )
-                    task_status = response["state"]
-                    print(f"Current task status: {task_status}")
-                    time.sleep(15)
-                if task_status == "COMPLETED":
-                    print(f"Model '{model_name}' registered successfully.")
-                    model_id = response["model_id"]
-                    # deploy the model
-                    deploy_response = self.ops.transport.perform_request(
-                        "POST", f"/_plugins/_ml/models/{model_id}/_deploy"
-                    )
-                    deploy_task_id = deploy_response["task_id"]
-                    print(
-                        f"task id: {deploy_task_id} for model '{model_name}' deployment received."
-                    )
-                    # wait for the model to be deployed
-                    deploy_task_status = None
-                    while deploy_task_status not in ["COMPLETED", "FAILED"]:
-                        print(
-                            f"Waiting for model '{model_name}' deployment to complete..."
-                        )
-                        deploy_task_status = self.ops.transport.perform_request(
-                            "GET", f"/_plugins/_ml/tasks/{deploy_task_id}"
-                        )["state"]
-                        print(f"Current task status: {deploy_task_status}")
-                        time.sleep(15)
-                    if deploy_task_status == "COMPLETED":
-                        print(f"Model '{model_name}' deployed successfully.")
-                    else:
-                        print(
-                            f"Model '{model_name}' deployment failed. Task status is {deploy_task_status}"
-                        )
-                elif task_status == "FAILED":
-                    print(
-                        f"Model '{model_name}' registration failed. Task status is {task_status}"
-                    )
-                else:
-                    print(
-                        f"Model '{model_name}' registration failed. Task status is {task_status}"
-                    )
+        return deployer.run({SPARSE_MODEL_NAME: "1.0.0", DENSE_MODEL_NAME: "1.0.2"})
 
     def create_pipelines(self):
         self.ops.ingest.put_pipeline(
@@ -217,13 +319,13 @@ class Search:
                 "processors": [
                     {
                         "sparse_encoding": {
-                            "model_id": self.get_model_id("amazon/neural-sparse/opensearch-neural-sparse-encoding-v2-distill"),
+                            "model_id": self.get_model_id(SPARSE_MODEL_NAME),
                             "field_map": {"summary": "summary_sparse_embedding"},
                         }
                     },
                     {
                         "text_embedding": {
-                            "model_id": self.get_model_id("huggingface/sentence-transformers/all-MiniLM-L6-v2"),
+                            "model_id": self.get_model_id(DENSE_MODEL_NAME),
                             "field_map": {"summary": "summary_dense_embedding"},
                         }
                     },
@@ -251,18 +353,70 @@ class Search:
             },
         )
         print("RRF search pipeline created.")
+        # score normalization and weighted combination, for the "weighted" retrieval modes
+        combination = {"technique": "arithmetic_mean"}
+        weights = os.getenv("FUSION_WEIGHTS")
+        if weights:
+            combination["parameters"] = {
+                "weights": [float(weight) for weight in weights.split(",")]
+            }
+        self.ops.transport.perform_request(
+            "PUT",
+            "/_search/pipeline/weighted-pipeline",
+            body={
+                "description": "Post processor for hybrid search with weighted score combination",
+                "phase_results_processors": [
+                    {
+                        "normalization-processor": {
+                            "normalization": {"technique": "min_max"},
+                            "combination": combination,
+                        }
+                    }
+                ],
+            },
+        )
+        print("Weighted search pipeline created.")
 
-    def create_index(self):
-        self.ops.indices.delete(index="my_documents", ignore_unavailable=True)
+    def create_index(self, index=INDEX_NAME, fast_ingest=False):
+        if index == INDEX_NAME:
+            if self.ops.indices.exists_alias(name=INDEX_NAME):
+                # a previous zero-downtime reindex left an alias, drop the indices behind it
+                self.ops.indices.delete(index=",".join(self.versioned_indices()))
+            self.ops.indices.delete(index=INDEX_NAME, ignore_unavailable=True)
+        settings = {
+            "index.knn": True,
+            "default_pipeline": "hybrid-ingest-pipeline",
+        }
+        if fast_ingest:
+            # no replicas and no refreshes while bulk loading, restored by finalize_index
+            settings["number_of_replicas"] = 0
+            settings["refresh_interval"] = "-1"
         self.ops.indices.create(
-            index="my_documents",
+            index=index,
             body={
-                "settings": {
-                    "index.knn": True,
-                    "default_pipeline": "hybrid-ingest-pipeline",
-                },
+                "settings": settings,
                 "mappings": {
                     "properties": {
+                        # search_as_you_type subfields index edge n-grams and shingles, so
+                        # autocomplete prefixes are resolved at index time
+                        "name": {
+                            "type": "text",
+                            "fields": {
+                                "keyword": {"type": "keyword", "ignore_above": 256},
+                                "suggest": {"type": "search_as_you_type"},
+                            },
+                        },
+                        "category": {
+                            "type": "text",
+                            "fields": {
+                                "keyword": {"type": "keyword", "ignore_above": 256},
+                                "suggest": {"type": "search_as_you_type"},
+                            },
+                        },
+                        "summary": {
+                            "type": "text",
+                            "fields": {"suggest": {"type": "search_as_you_type"}},
+                        },
                         "summary_dense_embedding": {
                             "type": "knn_vector",
                             "dimension": 384,
@@ -275,37 +429,514 @@ class Search:
                         "summary_sparse_embedding": {
                             "type": "rank_features",
                         },
+                        # fingerprint compared by incremental syncs
+                        "content_hash": {"type": "keyword", "index": False},
+                        # stable ID copy used as the tiebreaker of search_after pagination
+                        "doc_id": {"type": "keyword"},
                     }
                 },
             },
         )
 
+    # versioned indices created by zero-downtime reindexes, oldest first
+    def versioned_indices(self):
+        indices = self.ops.indices.get_alias(
+            index=f"{INDEX_NAME}-*", allow_no_indices=True, expand_wildcards="open"
+        )
+        return sorted(indices)
+
+    def live_indices(self):
+        if not self.ops.indices.exists_alias(name=INDEX_NAME):
+            return []
+        return sorted(self.ops.indices.get_alias(name=INDEX_NAME))
+
+    # restore production settings on a freshly loaded index and merge it for fast searches
+    def finalize_index(self, index):
+        self.ops.indices.put_settings(
+            index=index,
+            body={
+                "index": {
+                    "number_of_replicas": int(os.getenv("INDEX_REPLICAS", "1")),
+                    "refresh_interval": os.getenv("INDEX_REFRESH_INTERVAL", "1s"),
+                }
+            },
+        )
+        self.ops.indices.refresh(index=index)
+        self.ops.indices.forcemerge(index=index, max_num_segments=1, request_timeout=3600)
+        health = self.ops.cluster.health(
+            index=index, wait_for_status="green", timeout="10m", request_timeout=660
+        )
+        if health.get("timed_out"):
+            print(f"Index '{index}' replicas are not allocated yet (status {health['status']}).")
+        print(f"Index '{index}' refreshed, replicated and force-merged.")
+
+    # atomically point the alias at the given index
+    def swap_alias(self, index):
+        actions = []
+        if self.ops.indices.exists_alias(name=INDEX_NAME):
+            for live_index in self.live_indices():
+                actions.append({"remove": {"index": live_index, "alias": INDEX_NAME}})
+        elif self.ops.indices.exists(index=INDEX_NAME):
+            # replace the concrete index left by a regular reindex in the same request
+            actions.append({"remove_index": {"index": INDEX_NAME}})
+        actions.append({"add": {"index": index, "alias": INDEX_NAME}})
+        self.ops.indices.update_aliases(body={"actions": actions})
+        self.query_cache.bump_generation()
+        print(f"Alias '{INDEX_NAME}' now points to '{index}'.")
+
+    # delete all but the newest `keep` indices that are not behind the alias
+    def prune_indices(self, keep):
+        live = set(self.live_indices())
+        previous = [index for index in self.versioned_indices() if index not in live]
+        stale = previous[: max(len(previous) - keep, 0)]
+        if stale:
+            self.ops.indices.delete(index=",".join(stale))
+            print(f"Deleted old indices: {', '.join(stale)}")
+
+    # point the alias back at the newest index older than the live one
+    def rollback_index(self):
+        live = self.live_indices()
+        if not live:
+            raise ValueError(f"Alias '{INDEX_NAME}' does not exist, nothing to roll back.")
+        previous = [index for index in self.versioned_indices() if index < min(live)]
+        if not previous:
+            raise ValueError("No previous index is available to roll back to.")
+        self.swap_alias(previous[-1])
+        return previous[-1]
+
     def insert_document(self, document):
-        return self.ops.index(index="my_documents", body=document)
+        response = self.ops.index(index=INDEX_NAME, body=document)
+        self.query_cache.bump_generation()
+        return response
 
     def insert_documents(self, documents):
         operations = []
         for document in documents:
-            operations.append({"index": {"_index": "my_documents"}})
+            operations.append({"index": {"_index": INDEX_NAME}})
             operations.append(document)
-        return self.ops.bulk(body=operations)
+        response = self.ops.bulk(body=operations)
+        self.query_cache.bump_generation()
+        return response
+
+    def reindex(
+        self,
+        path="data.json",
+        batch_size=500,
+        max_bytes=5 * 1024 * 1024,
+        workers=4,
+        zero_downtime=False,
+        keep=2,
+        snapshot=None,
+        facets_snapshot=None,
+    ):
+        documents = iter_documents(path)
+        if snapshot:
+            collector = SnapshotCollector()
+            documents = collector.collect(documents)
+        if not zero_downtime:
+            self.create_index()
+            stats = self.ingest_documents(
+                documents, batch_size=batch_size, max_bytes=max_bytes, workers=workers
+            )
+            self.query_cache.bump_generation()
+            if snapshot:
+                collector.save(snapshot)
+            if facets_snapshot:
+                self.save_facets_snapshot(facets_snapshot)
+            return stats
+        # build a new versioned index while the alias keeps serving the current one
+        index = f"{INDEX_NAME}-{time.strftime('%Y%m%d%H%M%S')}"
+        self.create_index(index, fast_ingest=True)
+        print(f"Building index '{index}'...")
+        stats = self.ingest_documents(
+            documents,
+            batch_size=batch_size,
+            max_bytes=max_bytes,
+            workers=workers,
+            index=index,
+        )
+        self.finalize_index(index)
+        self.swap_alias(index)
+        if snapshot:
+            collector.save(snapshot)
+        if facets_snapshot:
+            self.save_facets_snapshot(facets_snapshot)
+        self.prune_indices(keep)
+        stats["index"] = index
+        return stats
+
+    # facets of the landing view and of every single-category and single-year view from
+    # one aggregation request, for the app to serve without aggregating per request
+    def save_facets_snapshot(self, path):
+        self.ops.indices.refresh(index=INDEX_NAME)
+        response = self.ops.search(
+            index=INDEX_NAME,
+            body={
+                "query": {"match_all": {}},
+                "aggs": SNAPSHOT_AGGS,
+                "size": 0,
+                "track_total_hits": True,
+            },
+        )
+        views = facet_views(response)
+        save_snapshot(path, views)
+        print(f"Facets snapshot with {len(views)} views written to {path}")
+        return views
+
+    # {id: content_hash} of every indexed document
+    def indexed_hashes(self):
+        return {
+            hit["_id"]: hit["_source"].get("content_hash")
+            for hit in scan(
+                self.ops,
+                index=INDEX_NAME,
+                query={"_source": ["content_hash"]},
+                size=1000,
+            )
+        }
+
+    # index only new or changed documents and delete the ones no longer in the file
+    def sync(
+        self,
+        path="data.json",
+        manifest=None,
+        batch_size=500,
+        max_bytes=5 * 1024 * 1024,
+        workers=4,
+        snapshot=None,
+        facets_snapshot=None,
+    ):
+        indexed = load_manifest(manifest) if manifest else None
+        if indexed is None:
+            indexed = self.indexed_hashes()
+        counts = {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0, "duplicates": 0}
+        documents = iter_documents(path)
+        if snapshot:
+            collector = SnapshotCollector()
+            documents = collector.collect(documents)
+        operations = sync_operations(documents, indexed, INDEX_NAME, counts)
+        batches = batch_operations(operations, max_docs=batch_size, max_bytes=max_bytes)
+        stats = BulkIngester(self.ops, workers=workers).run(batches)
+        self.query_cache.bump_generation()
+        if snapshot:
+            collector.save(snapshot)
+        if facets_snapshot:
+            self.save_facets_snapshot(facets_snapshot)
+        # a manifest that recorded failed documents would hide them from the next sync
+        if manifest and not stats["errors"]:
+            save_manifest(manifest, indexed)
+        stats.update(counts)
+        return stats
 
-    def reindex(self):
-        self.create_index()
-        with open("data.json", "rt") as f:
-            documents = json.loads(f.read())
-        return self.insert_documents(documents)
+    # stream documents into the index in bounded, parallel bulk batches
+    def ingest_documents(
+        self, documents, batch_size=500, max_bytes=5 * 1024 * 1024, workers=4, index=INDEX_NAME
+    ):
+        counts = {"duplicates": 0}
+        batches = batch_documents(
+            documents, index, counts, max_docs=batch_size, max_bytes=max_bytes
+        )
+        stats = BulkIngester(self.ops, workers=workers).run(batches)
+        stats.update(counts)
+        return stats
 
-    def search(self, **query_args):
+    def search(self, search_pipeline="rrf-pipeline", **query_args):
         if "from_" in query_args:
             query_args["from"] = query_args["from_"]
             del query_args["from_"]
-        print(f"query args: {query_args}")
-        return self.ops.search(
-            index="my_documents",
-            body=query_args,
-            params={"search_pipeline": "rrf-pipeline"},
+        query_args.setdefault("_source", {"excludes": EMBEDDING_FIELDS})
+        start = time.perf_counter()
+        try:
+            response = self.ops.search(
+                index=INDEX_NAME,
+                body=query_args,
+                params={"search_pipeline": search_pipeline} if search_pipeline else {},
+            )
+        except Exception as exc:
+            if is_model_not_found(exc):
+                self.model_ids.refresh_in_background()
+            raise
+        record_query("search", query_args, time.perf_counter() - start, response)
+        return response
+
+    def _msearch(self, body, search_pipeline=None):
+        start = time.perf_counter()
+        try:
+            response = self.ops.msearch(
+                body=body,
+                params={"search_pipeline": search_pipeline} if search_pipeline else {},
+            )
+        except Exception as exc:
+            if is_model_not_found(exc):
+                self.model_ids.refresh_in_background()
+            raise
+        record_query("msearch", body, time.perf_counter() - start, response)
+        return response["responses"]
+
+    # IDs of the models the subqueries of a retrieval mode run
+    def mode_model_ids(self, mode):
+        model_ids = {}
+        if "sparse" in mode.subqueries:
+            model_ids["sparse"] = self.get_model_id(SPARSE_MODEL_NAME)
+        if "dense" in mode.subqueries:
+            model_ids["dense"] = self.get_model_id(DENSE_MODEL_NAME)
+        return model_ids
+
+    # run the results-page query for every query string in one _msearch round trip;
+    # responses come back in input order, failed queries as {"error": ...}. Queries with
+    # text are not retrieved past the maximum depth of the mode, a page beyond it is an
+    # error; filter-only queries page like browse pages
+    def multi_search(self, queries, size=5, from_=0, mode=None, **query_args):
+        mode = mode or get_mode("hybrid")
+        depth = mode.depth(from_, size)
+        query_args = {"_source": {"excludes": EMBEDDING_FIELDS}, **query_args}
+        body = []
+        # per query: its fused subquery rankings, None for a single server-side search, or
+        # the error of a query that is not sent
+        fusions = []
+        model_ids = None
+        for query in queries:
+            _, parsed_query = extract_filters(query)
+            if parsed_query.strip() and mode.exhausted(from_):
+                fusions.append(
+                    {
+                        "error": {
+                            "type": "max_depth_exceeded",
+                            "reason": f"Results past {mode.max_depth} are not retrieved "
+                            f"in mode {mode!r}.",
+                        }
+                    }
+                )
+                continue
+            query_tokens = None
+            if parsed_query.strip():
+                if model_ids is None:
+                    model_ids = self.mode_model_ids(mode)
+                if "sparse" in mode.subqueries:
+                    # a predict call per missed query would serialize the batch, misses
+                    # fall back to query_text
+                    query_tokens = self.cached_query_tokens(parsed_query, model_ids["sparse"])
+            search_query, _ = query_bodies(
+                query,
+                model_ids if parsed_query.strip() else {},
+                depth=depth,
+                query_tokens=query_tokens,
+                subqueries=mode.subqueries,
+            )
+            if mode.local and parsed_query.strip():
+                fusion = self._cached_rankings(
+                    search_query["hybrid"]["queries"], depth, query_args
+                )
+                body.extend(fusion[2])
+                fusions.append(fusion)
+                continue
+            body.append({"index": INDEX_NAME})
+            body.append({"query": search_query, "size": size, "from": from_, **query_args})
+            fusions.append(None)
+        if not fusions:
+            return []
+        responses = iter(self._msearch(body, mode.pipeline) if body else [])
+        results = []
+        for fusion in fusions:
+            if fusion is None:
+                results.append(next(responses))
+                continue
+            if isinstance(fusion, dict):
+                # rejected before it was sent
+                results.append(fusion)
+                continue
+            parts, rankings, fusion_body = fusion
+            fetched = [next(responses) for _ in range(len(fusion_body) // 2)]
+            results.append(self._fuse(parts, rankings, fetched, size, from_))
+        return results
+
+    # cached rankings of the subqueries of a locally fused query (None where missing), and
+    # the _msearch body that fetches the missing ones
+    def _cached_rankings(self, subqueries, depth, query_args):
+        parts = [
+            {"subquery": subquery, "depth": depth, "args": query_args} for subquery in subqueries
+        ]
+        rankings = [self.query_cache.get(part) for part in parts]
+        body = []
+        for part, ranking in zip(parts, rankings):
+            if ranking is None:
+                body.append({"index": INDEX_NAME})
+                body.append(
+                    {
+                        "query": part["subquery"],
+                        "size": depth,
+                        "track_total_hits": False,
+                        **query_args,
+                    }
+                )
+        return parts, rankings, body
+
+    # fill in the fetched rankings, cache them and fuse one page; {"error": ...} if a
+    # subquery failed
+    def _fuse(self, parts, rankings, fetched, size, from_):
+        fetched = iter(fetched)
+        rankings = list(rankings)
+        for idx, ranking in enumerate(rankings):
+            if ranking is None:
+                ranking = rankings[idx] = next(fetched)
+                if "error" in ranking:
+                    return {"error": ranking["error"]}
+                self.query_cache.set(parts[idx], ranking)
+        return reciprocal_rank_fusion(rankings, size, from_)
+
+    # fuse the rankings of separately run subqueries in the app (local reciprocal rank
+    # fusion); each ranking is cached on its own, so other pages and other modes that use
+    # the same subquery reuse it
+    def local_fusion_search(self, subqueries, size=5, from_=0, depth=None, **query_args):
+        depth = depth or pagination_depth(from_, size)
+        query_args.setdefault("_source", {"excludes": EMBEDDING_FIELDS})
+        parts, rankings, body = self._cached_rankings(subqueries, depth, query_args)
+        result = self._fuse(parts, rankings, self._msearch(body) if body else [], size, from_)
+        if "error" in result:
+            raise TransportError(500, "subquery_failed", result["error"])
+        return result
+
+    # sparse token weights of a query text from the model predict API
+    def encode_sparse_query(self, text, model_id):
+        response = self.ops.transport.perform_request(
+            "POST",
+            f"/_plugins/_ml/_predict/sparse_encoding/{model_id}",
+            body={"text_docs": [text]},
         )
+        return sparse_tokens(response)
+
+    # token weights for the query if they are cached, None otherwise
+    def cached_query_tokens(self, parsed_query, model_id):
+        return self.query_tokens_cache.get(model_id, normalize_query(parsed_query))
+
+    # token weights for the query, from the cache or on a miss from one predict call that
+    # the facet and page requests of the query then share; None when the model call fails,
+    # so the caller falls back to query_text
+    def query_tokens(self, parsed_query, model_id):
+        tokens = self.cached_query_tokens(parsed_query, model_id)
+        if tokens is None:
+            text = normalize_query(parsed_query)
+            tokens = self._token_flight.call(
+                (model_id, text), lambda: self._fill_query_tokens(model_id, text)
+            )
+        return tokens
+
+    def _fill_query_tokens(self, model_id, text):
+        try:
+            tokens = self.encode_sparse_query(text, model_id)
+        except Exception as exc:
+            print(f"Could not encode query '{text}': {exc}")
+            return None
+        self.query_tokens_cache.set(model_id, text, tokens)
+        return tokens
+
+    # precompute token weights for the queries of a log, one query per line
+    def warm_query_tokens(self, queries, output):
+        model_id = self.get_model_id(SPARSE_MODEL_NAME)
+        snapshot = {}
+        if os.path.exists(output):
+            with open(output, "rt") as f:
+                snapshot = json.load(f)
+        encoded = snapshot.setdefault(model_id, {})
+        for query in queries:
+            _, parsed_query = extract_filters(query)
+            text = normalize_query(parsed_query)
+            if text and text not in encoded:
+                encoded[text] = self.encode_sparse_query(text, model_id)
+        with open(f"{output}.tmp", "wt") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{output}.tmp", output)
+        return len(encoded)
+
+    def open_point_in_time(self, keep_alive="5m"):
+        return self.ops.create_point_in_time(index=INDEX_NAME, keep_alive=keep_alive)["pit_id"]
+
+    # point in time for a new browse session; one is shared by all sessions starting within
+    # `pit_reuse` seconds of each other, so the number of open PITs grows with time rather
+    # than with users, and each one expires `keep_alive` after its last page
+    def browse_point_in_time(self):
+        pit_id = self._shared_pit()
+        if pit_id is None:
+            pit_id = self._share_pit(self.open_point_in_time())
+        return pit_id
+
+    def _shared_pit(self):
+        with self._pit_lock:
+            if self._pit is None:
+                return None
+            pit_id, opened, generation = self._pit
+            if time.monotonic() - opened >= self.pit_reuse:
+                return None
+            if generation != self.query_cache.generation():
+                return None
+            return pit_id
+
+    def _share_pit(self, pit_id):
+        with self._pit_lock:
+            self._pit = (pit_id, time.monotonic(), self.query_cache.generation())
+        return pit_id
+
+    # stop handing out a point in time that has expired or was closed
+    def forget_point_in_time(self, pit_id):
+        with self._pit_lock:
+            if self._pit is not None and self._pit[0] == pit_id:
+                self._pit = None
+
+    # next page of a point-in-time search, starting after the sort values of the last hit
+    def search_after(self, pit_id, after, keep_alive="5m", **query_args):
+        query_args["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+        query_args["search_after"] = after
+        query_args.setdefault("_source", {"excludes": EMBEDDING_FIELDS})
+        start = time.perf_counter()
+        response = self.ops.search(body=query_args)
+        record_query("search_after", query_args, time.perf_counter() - start, response)
+        return response
 
     def retrieve_document(self, id):
-        return self.ops.get(index="my_documents", id=id)
\ No newline at end of file
+        return self.ops.get(index=INDEX_NAME, id=id, _source_includes=DOCUMENT_FIELDS)
+
+    # sources of several documents in one _mget round trip, by ID; missing IDs are left out
+    def retrieve_documents(self, ids, fields=DOCUMENT_FIELDS):
+        if not ids:
+            return {}
+        response = self.ops.mget(index=INDEX_NAME, body={"ids": list(ids)}, _source_includes=fields)
+        return {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+
+    # warm the document page cache for the hits of a results page in the background, so
+    # following a result does not wait for the cluster
+    def prefetch_documents(self, ids):
+        with self._prefetch_lock:
+            ids = [
+                id
+                for id in ids
+                if id not in self._prefetching
+                and self.document_cache.get(id, record=False) is None
+            ]
+            if not ids or not self._prefetch_slots.acquire(blocking=False):
+                return
+            self._prefetching.update(ids)
+        self._prefetch_executor.submit(self._fill_documents, ids)
+
+    def _fill_documents(self, ids):
+        try:
+            for id, source in self.retrieve_documents(ids).items():
+                self.document_cache.set(id, document_payload(source))
+        except Exception as exc:
+            print(f"Could not prefetch documents: {exc}")
+        finally:
+            with self._prefetch_lock:
+                self._prefetching.difference_update(ids)
+            self._prefetch_slots.release()
+
+
+def sparse_tokens(predict_response):
+    return predict_response["inference_results"][0]["output"][0]["dataAsMap"]["response"][0]
+
+
+def empty_response():
+    return {"took": 0, "hits": {"total": {"value": 0, "relation": "eq"}, "hits": []}}
+
+
+# what the document page renders
+def document_payload(source):
+    return {"title": source["name"], "paragraphs": source["content"].split("\n")}
\ No newline at end of file
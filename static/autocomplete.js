@@ -3,19 +3,38 @@ const input = document.getElementById('query');
 const dropdown = document.getElementById('autocomplete-dropdown');
 
 let lastTerm = "";
-input.addEventListener('input', async function (e) {
-    let val = e.target.value.trim();
+let debounceTimer = null;
+let pending = null; // AbortController of the in-flight request
+const DEBOUNCE_MS = 150;
+
+input.addEventListener('input', function (e) {
+    clearTimeout(debounceTimer);
+    // wait until the user pauses typing before asking the server
+    debounceTimer = setTimeout(() => suggest(e.target.value.trim()), DEBOUNCE_MS);
+});
+
+async function suggest(val) {
     lastTerm = val;
+    // a newer term makes the previous request stale
+    if (pending) pending.abort();
     if (val.length < 2) {
         dropdown.style.display = 'none';
         return;
     }
-    const resp = await fetch('/autocomplete', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-        body: 'query=' + encodeURIComponent(val)
-    });
-    const suggestions = await resp.json();
+    pending = new AbortController();
+    let suggestions;
+    try {
+        // GET with the normalized term, so the browser cache and CDNs can answer repeats
+        const term = val.toLowerCase().split(/\s+/).join(' ');
+        const resp = await fetch('/autocomplete?q=' + encodeURIComponent(term), {
+            signal: pending.signal
+        });
+        suggestions = await resp.json();
+    } catch (err) {
+        if (err.name === 'AbortError') return;
+        throw err;
+    }
+    if (val !== lastTerm) return;
 
     dropdown.innerHTML = '';
     if (suggestions.length === 0) {
@@ -35,7 +54,7 @@ input.addEventListener('input', async function (e) {
         dropdown.appendChild(li);
     });
     dropdown.style.display = 'block';
-});
+}
 //hide dropdown on click outside i.e. not on input(searchbox) or dropdown
 document.addEventListener('click', function (event) {
     if (!input.contains(event.target) && !dropdown.contains(event.target)) {
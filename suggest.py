@@ -0,0 +1,196 @@
+import json
+import os
+import re
+from bisect import bisect_left
+
+from cache import PolledFile
+from ingest import document_id
+
+TOKEN_REGEX = re.compile(r"\w+")
+# same relative weights as the name and category clauses of the OpenSearch query
+FIELD_BOOSTS = (1.2, 1.0)
+
+
+def tokenize(text):
+    return TOKEN_REGEX.findall((text or "").lower())
+
+
+# spread `size` suggestions across categories the same way for every suggestion source;
+# groups are {"category", "total", "hits": [{"itemId", "name"}]} in ranking order
+def balance_suggestions(groups, size):
+    cats_with_hits = len(groups)
+    avg_hits_cat = int(size / cats_with_hits) if cats_with_hits > 0 else 0
+    hits_for_cats = []
+    accum_hits = 0
+    cats_with_more = 0
+
+    for group in groups:
+        cat_hits = group["total"]
+        if cat_hits > avg_hits_cat:
+            cats_with_more += 1
+        hits_this_cat = min(cat_hits, avg_hits_cat)
+        hits_for_cats.append([cat_hits, hits_this_cat])
+
+    if accum_hits < size and cats_with_more:
+        more_each = int((size - accum_hits) / cats_with_more)
+        for counts in hits_for_cats:
+            more_this_cat = min(more_each, counts[0] - counts[1])
+            accum_hits += more_this_cat
+            counts[1] += more_this_cat
+
+    found_items = []
+
+    for idx, group in enumerate(groups):
+        if accum_hits < size and hits_for_cats[idx][1] < hits_for_cats[idx][0]:
+            to_add = min(size - accum_hits, hits_for_cats[idx][0] - hits_for_cats[idx][1])
+            hits_for_cats[idx][1] += to_add
+            accum_hits += to_add
+
+        added = 0
+        for hit in group["hits"]:
+            found_items.append({
+                'itemId': hit['itemId'],
+                'name': hit['name'],
+                'category': group['category'],
+            })
+            added += 1
+            if added == hits_for_cats[idx][1]:
+                break
+    return found_items
+
+
+# whether suggestions for `longer` are a subset of those for `shorter`: same leading
+# terms, and the last term of `longer` extends the last term of `shorter`
+def extends_prefix(shorter, longer):
+    shorter_terms = tokenize(shorter)
+    longer_terms = tokenize(longer)
+    return (
+        bool(shorter_terms)
+        and len(shorter_terms) == len(longer_terms)
+        and shorter_terms[:-1] == longer_terms[:-1]
+        and longer_terms[-1].startswith(shorter_terms[-1])
+    )
+
+
+# narrow down a complete suggestion list for a longer prefix by checking name, category
+# and summary, the fields the "search_as_you_type" autocomplete mode matches; lists of the
+# "prefix" mode cannot be narrowed down, it also matches content
+def filter_groups(groups, text):
+    terms = tokenize(text)
+    leading, last = set(terms[:-1]), terms[-1]
+
+    def matches(tokens):
+        return any(token in leading or token.startswith(last) for token in tokens)
+
+    filtered = []
+    for group in groups:
+        category_tokens = tokenize(group["category"])
+        hits = [
+            hit
+            for hit in group["hits"]
+            if matches(category_tokens + tokenize(hit["name"]) + tokenize(hit.get("summary")))
+        ]
+        if hits:
+            filtered.append({"category": group["category"], "total": len(hits), "hits": hits})
+    return filtered
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over document names and categories."""
+
+    def __init__(self, documents):
+        # documents are [id, name, category] triples
+        self.documents = [tuple(document) for document in documents]
+        postings = {}
+        for doc, (_, name, category) in enumerate(self.documents):
+            for field, text in enumerate((name, category)):
+                for token in tokenize(text):
+                    postings.setdefault(token, set()).add((doc, field))
+        self.tokens = sorted(postings)
+        self.postings = [sorted(postings[token]) for token in self.tokens]
+
+    def matches(self, term, prefix=False):
+        start = bisect_left(self.tokens, term)
+        for idx in range(start, len(self.tokens)):
+            token = self.tokens[idx]
+            if token != term and not (prefix and token.startswith(term)):
+                break
+            yield from self.postings[idx]
+
+    # category groups ranked like the collapsed match_bool_prefix query: every term but the
+    # last matches whole tokens, the last one matches token prefixes, and each matching
+    # term adds the boost of the best field it matched
+    def search(self, text, size=10, collapse_size=5):
+        terms = tokenize(text)
+        if not terms:
+            return []
+        scores = {}
+        for position, term in enumerate(terms):
+            best = {}
+            for doc, field in self.matches(term, prefix=position == len(terms) - 1):
+                best[doc] = max(best.get(doc, 0.0), FIELD_BOOSTS[field])
+            for doc, boost in best.items():
+                scores[doc] = scores.get(doc, 0.0) + boost
+        by_category = {}
+        for doc in sorted(scores, key=lambda doc: (-scores[doc], self.documents[doc][1])):
+            by_category.setdefault(self.documents[doc][2], []).append(doc)
+        groups = []
+        for category, docs in list(by_category.items())[:size]:
+            groups.append({
+                "category": category,
+                "total": len(docs),
+                "hits": [
+                    {"itemId": self.documents[doc][0], "name": self.documents[doc][1]}
+                    for doc in docs[:collapse_size]
+                ],
+            })
+        return groups
+
+    def save(self, path):
+        with open(f"{path}.tmp", "wt") as f:
+            json.dump({"documents": self.documents}, f)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rt") as f:
+            return cls(json.load(f)["documents"])
+
+
+class SnapshotCollector:
+    """Collects suggestion entries from a document stream while it is being ingested."""
+
+    def __init__(self):
+        self.documents = []
+
+    def collect(self, documents):
+        seen = set()
+        for document in documents:
+            id = document_id(document)
+            # duplicates are skipped by the ingest, keep the first one like it does
+            if id not in seen:
+                seen.add(id)
+                self.documents.append([id, document.get("name"), document.get("category")])
+            yield document
+
+    def save(self, path):
+        PrefixIndex(self.documents).save(path)
+        print(f"Autocomplete snapshot with {len(self.documents)} entries written to {path}")
+
+
+class LocalSuggester:
+    """Serves a PrefixIndex snapshot, reloading it when the file is rewritten by a reindex."""
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self._file = PolledFile(path, PrefixIndex.load, check_interval)
+
+    @property
+    def version(self):
+        return self._file.version
+
+    def search(self, text, size=10, collapse_size=5):
+        index = self._file.get()
+        if index is None:
+            return []
+        return index.search(text, size=size, collapse_size=collapse_size)